@@ -0,0 +1,5 @@
+# app/__main__.py
+import sys
+from app.cli import main
+
+sys.exit(main())
@@ -0,0 +1,276 @@
+# app/cli.py
+"""
+Headless recolouring: python -m app --rules rules.json --input models/ --output out/
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from core.io_ifc import open_ifc, save_ifc, save_ifc_patched
+from core.colorize import RecolorSession
+from core.rules import compile_rules
+from core.psets import PropertyTables
+from utils.ifc_helpers import StyleGraph
+from app.index_cache import IndexCache, resolved_count
+from utils.hashing import hash_file
+from utils.profiling import Profiler
+
+def _expand_inputs(inputs, recursive=False):
+    """Return [(src, rel)] for files, directories and glob patterns; rel is the output-relative name."""
+    out = []
+    for raw in inputs:
+        p = Path(raw)
+        if p.is_dir():
+            pattern = "**/*.ifc" if recursive else "*.ifc"
+            for f in sorted(p.glob(pattern)):
+                if f.is_file():
+                    out.append((f, f.relative_to(p)))
+        elif p.is_file():
+            out.append((p, Path(p.name)))
+        else:
+            for f in sorted(glob.glob(raw, recursive=recursive)):
+                f = Path(f)
+                if f.is_file():
+                    out.append((f, Path(f.name)))
+    # same file reached twice (e.g. dir + glob) → once
+    seen, uniq = set(), []
+    for src, rel in out:
+        key = src.resolve()
+        if key not in seen:
+            seen.add(key)
+            uniq.append((src, rel))
+    return uniq
+
+def _plan_outputs(files, output, suffix):
+    """Map each input to its output path; a single input may name the output file directly."""
+    if output and len(files) == 1 and Path(output).suffix.lower() == ".ifc":
+        return [(files[0][0], Path(output))]
+    jobs = []
+    for src, rel in files:
+        base = Path(output) if output else src.parent
+        dst = (base / rel).with_name(f"{rel.stem}{suffix}.ifc") if output else src.with_name(f"{src.stem}{suffix}.ifc")
+        jobs.append((src, dst))
+    dsts = [d.resolve() for _, d in jobs]
+    if len(set(dsts)) != len(dsts):
+        raise ValueError("several inputs map to the same output file; use a directory input or --suffix")
+    return jobs
+
+def _profile_paths(jobs, directory):
+    """One output stem per input under `directory` (name clashes get a counter)."""
+    out, used = {}, set()
+    for src, _ in jobs:
+        stem, n = src.stem, 1
+        while stem in used:
+            n += 1
+            stem = f"{src.stem}-{n}"
+        used.add(stem)
+        out[src] = str(Path(directory) / stem)
+    return out
+
+def _write_profile(prof, base):
+    Path(base).parent.mkdir(parents=True, exist_ok=True)
+    Path(f"{base}.profile.json").write_text(prof.to_json(), encoding="utf-8")
+    Path(f"{base}.speedscope.json").write_text(json.dumps(prof.to_speedscope(Path(base).name)), encoding="utf-8")
+    prof.dump_cprofile(f"{base}.pstats")
+    return f"{base}.profile.json"
+
+def process_file(src, dst, rules, dry_run=False, options=None, profile=None, index_cache=None):
+    """
+    Recolour one IFC; never raises, returns a result dict with per-phase timing.
+    `options` are extra keyword arguments for RecolorSession, plus
+    "patch_output": write only the changed records into a copy of `src`
+    (core.io_ifc.save_ifc_patched) instead of re-serializing. `profile`
+    is a path stem: the recolour step is profiled and written to
+    <stem>.profile.json, <stem>.speedscope.json and <stem>.pstats.
+    `index_cache` is an IndexCache directory: property tables and style maps
+    of a file seen before are loaded from it instead of rebuilt.
+    """
+    options = dict(options or {})
+    patch = options.pop("patch_output", False)
+    prof = None
+    if profile:
+        prof = Profiler(cprofile=True)
+    res = {"input": str(src), "output": None if dry_run else str(dst), "ok": False}
+    t0 = time.perf_counter()
+    timing = {}
+    try:
+        plan = compile_rules(rules)
+        t = time.perf_counter()
+        model = open_ifc(src)
+        timing["load"] = time.perf_counter() - t
+        cached = None
+        if index_cache:
+            t = time.perf_counter()
+            cache = IndexCache(index_cache)
+            content_hash = hash_file(src)
+            cached = cache.load(model, content_hash)
+            if cached is not None:
+                options.update(props=cached.props, styles=cached.styles)
+            else:
+                options.update(props=PropertyTables(), styles=StyleGraph(model))
+            timing["index_cache"] = time.perf_counter() - t
+            res["index_cache"] = "hit" if cached is not None else "miss"
+        t = time.perf_counter()
+        session = RecolorSession(model, **options)
+        if dry_run:
+            stats = session.run(plan, dry_run=True, profile=prof)
+        else:
+            model, stats = session.run(plan, profile=prof)
+        timing["recolor"] = time.perf_counter() - t
+        # rewrite the entry only if this run extracted tables or products it lacked
+        if index_cache and resolved_count(options["props"], options["styles"]):
+            t = time.perf_counter()
+            # the app's editor index for this file, if any, is kept
+            cache.store(content_hash, options["props"], options["styles"])
+            timing["index_cache"] += time.perf_counter() - t
+        if not dry_run:
+            t = time.perf_counter()
+            Path(dst).parent.mkdir(parents=True, exist_ok=True)
+            if patch and Path(dst).resolve() != Path(src).resolve():
+                save_ifc_patched(model, dst, src, *session.journal())
+            else:
+                save_ifc(model, dst)
+            timing["save"] = time.perf_counter() - t
+        if prof is not None:
+            # the breakdown goes to its own files, not into the summary
+            stats.pop("profile", None)
+            res["profile"] = _write_profile(prof, profile)
+        res.update(ok=True, stats=stats)
+    except Exception as e:
+        res["error"] = f"{type(e).__name__}: {e}"
+    timing["total"] = time.perf_counter() - t0
+    res["seconds"] = {k: round(v, 3) for k, v in timing.items()}
+    return res
+
+def _crashed(src, dst, dry_run, reason="worker process crashed"):
+    return {"input": str(src), "output": None if dry_run else str(dst), "ok": False, "error": reason, "seconds": {}}
+
+def _report(res, out=sys.stderr):
+    secs = res.get("seconds", {})
+    phases = ", ".join(f"{k} {v:.2f}s" for k, v in secs.items() if k != "total")
+    if res["ok"]:
+        st = res.get("stats", {})
+        print(f"OK    {res['input']}  {secs.get('total', 0):.2f}s ({phases})  "
+              f"styles={st.get('changed_styles')} elements={st.get('touched_elements')}", file=out)
+    else:
+        print(f"FAIL  {res['input']}  {res.get('error')}", file=out)
+
+def run_jobs(jobs, rules, workers, dry_run=False, options=None, report=_report, profiles=None,
+             index_cache=None):
+    """
+    Run (src, dst) jobs and return their results in input order.
+    workers == 0 runs in this process. Otherwise files are spread over a
+    process pool; if a worker dies (segfault, OOM kill) the pool is rebuilt,
+    the unfinished files are retried, and files that were in flight during a
+    second crash are re-run alone so only the culprit is reported as failed.
+    `profiles` maps an input to its process_file(profile=...) stem;
+    `index_cache` is passed on to process_file.
+    """
+    profiles = profiles or {}
+    results = {}
+    if workers == 0:
+        for src, dst in jobs:
+            results[src] = process_file(src, dst, rules, dry_run, options, profiles.get(src), index_cache)
+            report(results[src])
+        return [results[src] for src, _ in jobs]
+
+    attempts = {}
+    pending = list(jobs)
+    while pending:
+        retry, isolate = [], []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futs = {pool.submit(process_file, src, dst, rules, dry_run, options, profiles.get(src), index_cache): (src, dst) for src, dst in pending}
+            for fut in as_completed(futs):
+                src, dst = futs[fut]
+                try:
+                    res = fut.result()
+                except BrokenProcessPool:
+                    attempts[src] = attempts.get(src, 0) + 1
+                    (isolate if attempts[src] > 1 else retry).append((src, dst))
+                    continue
+                results[src] = res
+                report(res)
+        for src, dst in isolate:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                try:
+                    res = pool.submit(process_file, src, dst, rules, dry_run, options, profiles.get(src), index_cache).result()
+                except BrokenProcessPool:
+                    res = _crashed(src, dst, dry_run)
+            results[src] = res
+            report(res)
+        pending = retry
+    return [results[src] for src, _ in jobs]
+
+def _parser():
+    ap = argparse.ArgumentParser(prog="python -m app", description="Recolour IFC models with a rules.json.")
+    ap.add_argument("--rules", "--map", dest="rules", required=True, help="rules.json exported from the app")
+    ap.add_argument("--input", "-i", dest="inputs", action="extend", nargs="+", required=True,
+                    help="IFC file(s), directories or glob patterns")
+    ap.add_argument("--output", "-o", help="output directory (or file, for a single input); default: next to input")
+    ap.add_argument("--suffix", default="_recolored", help="appended to output file names (default: _recolored)")
+    ap.add_argument("--recursive", "-r", action="store_true", help="descend into sub-directories / ** globs")
+    ap.add_argument("--workers", "-j", type=int, default=os.cpu_count() or 1,
+                    help="worker processes (0 = run in this process)")
+    ap.add_argument("--match-workers", type=int, default=None, metavar="N",
+                    help="also split rule matching inside each large model over N processes")
+    ap.add_argument("--dry-run", action="store_true", help="report matches only, write nothing")
+    ap.add_argument("--split-shared", action="store_true",
+                    help="clone styles shared by differently coloured elements instead of last-rule-wins")
+    ap.add_argument("--snap-delta-e", type=float, default=None, metavar="DE",
+                    help="reuse an existing colour within this CIE76 ΔE instead of adding a near-duplicate")
+    ap.add_argument("--patch-output", action="store_true",
+                    help="copy the input and rewrite only changed entity records (much faster for big files)")
+    ap.add_argument("--index-cache", metavar="DIR",
+                    help="reuse property tables / style maps of previously seen files from DIR (shared with the app)")
+    ap.add_argument("--summary", help="also write the JSON summary to this file")
+    ap.add_argument("--profile", metavar="DIR",
+                    help="write a per-phase profile of each file (JSON, speedscope trace, pstats) to DIR")
+    return ap
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    try:
+        with open(args.rules, encoding="utf-8") as f:
+            rules = json.load(f)
+        compile_rules(rules)  # fail fast on bad regexes / colours
+    except (OSError, ValueError) as e:
+        print(f"error: {args.rules}: {e}", file=sys.stderr)
+        return 2
+
+    files = _expand_inputs(args.inputs, recursive=args.recursive)
+    if not files:
+        print("error: no IFC files found", file=sys.stderr)
+        return 2
+    try:
+        jobs = _plan_outputs(files, args.output, args.suffix)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    t0 = time.perf_counter()
+    workers = max(0, min(args.workers, len(jobs)))
+    options = {"split_shared": args.split_shared, "snap": args.snap_delta_e, "snap_metric": "delta_e",
+               "workers": args.match_workers, "patch_output": args.patch_output}
+    profiles = _profile_paths(jobs, args.profile) if args.profile else None
+    results = run_jobs(jobs, rules, workers, dry_run=args.dry_run, options=options, profiles=profiles,
+                       index_cache=args.index_cache)
+    summary = {
+        "files": len(results),
+        "ok": sum(r["ok"] for r in results),
+        "failed": sum(not r["ok"] for r in results),
+        "dry_run": args.dry_run,
+        "workers": workers,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "results": results,
+    }
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    print(text)
+    if args.summary:
+        Path(args.summary).write_text(text, encoding="utf-8")
+    return 0 if summary["failed"] == 0 else 1
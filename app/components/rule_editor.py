@@ -23,10 +23,13 @@ def _ensure_ids(rules: list):
     return rules
 
 # ---------- helpers for dropdown data ----------
+WILDCARD_ENTITIES = (None, "", "*", "All", "Any", "All (*)")
+NONE = "—"
+
 def _scope_entities(pset_index, entity):
     if not pset_index:
         return []
-    if entity in (None, "", "*", "All", "Any", "All (*)"):
+    if entity in WILDCARD_ENTITIES:
         return list(pset_index.keys())
     return [entity] if entity in pset_index else []
 
@@ -48,35 +51,74 @@ def _value_options(pset_index, entity, pset, key):
         out.update(pset_index.get(et, {}).get(pset, {}).get(key, []))
     return sorted(out)
 
+class OptionIndex:
+    """
+    Dropdown choices per (entity scope, pset, key), each unioned and sorted
+    once and then reused by every condition row on every rerun. Choices come
+    as (options, position) with the "—" placeholder first.
+    """
+    def __init__(self, pset_index):
+        self.pset_index = pset_index or {}
+        self._memo = {}
+
+    def _get(self, key, build):
+        hit = self._memo.get(key)
+        if hit is None:
+            opts = [NONE] + build()
+            hit = self._memo[key] = (opts, {v: i for i, v in enumerate(opts)})
+        return hit
+
+    @staticmethod
+    def _scope(entity):
+        return "*" if entity in WILDCARD_ENTITIES else entity
+
+    def psets(self, entity):
+        scope = self._scope(entity)
+        return self._get((scope,), lambda: _pset_options(self.pset_index, scope))
+
+    def keys(self, entity, pset):
+        scope = self._scope(entity)
+        return self._get((scope, pset), lambda: _key_options(self.pset_index, scope, pset))
+
+    def values(self, entity, pset, key):
+        scope = self._scope(entity)
+        return self._get((scope, pset, key), lambda: _value_options(self.pset_index, scope, pset, key))
+
+def _option_index(pset_index, index_key=None):
+    """The OptionIndex for this pset index, kept in session state until the index changes."""
+    key = index_key if index_key is not None else id(pset_index)
+    hit = st.session_state.get("_rule_option_index")
+    if hit is None or hit[0] != key:
+        hit = st.session_state["_rule_option_index"] = (key, OptionIndex(pset_index))
+    return hit[1]
+
 # ---------- a single condition row ----------
-def _cond_row(rid: str, cond: dict, rule_entity: str, pset_index):
-    """If case == sensitive: render dropdowns; else: text inputs."""
+def _cond_row(rid: str, cond: dict, rule_entity: str, opts):
+    """If case == sensitive: render dropdowns (from the OptionIndex `opts`); else: text inputs."""
     c1, c2, c3, c4, c5, c6 = st.columns([1.4, 1.1, 1.0, 1.6, 1.1, 0.8])
 
     case_val = cond.get("case", "insensitive")
 
-    if case_val == "sensitive" and pset_index:
+    if case_val == "sensitive" and opts.pset_index:
         # dropdown mode (no free text)
-        p_opts = ["—"] + _pset_options(pset_index, rule_entity)
-        psel = c1.selectbox("Pset", p_opts,
-                            index=(p_opts.index(cond.get("pset")) if cond.get("pset") in p_opts else 0),
+        p_opts, p_pos = opts.psets(rule_entity)
+        psel = c1.selectbox("Pset", p_opts, index=p_pos.get(cond.get("pset"), 0),
                             key=f"pset_sel_{rid}_{cond['_id']}")
-        cond["pset"] = "" if psel == "—" else psel
+        cond["pset"] = "" if psel == NONE else psel
 
-        k_opts = ["—"] + (_key_options(pset_index, rule_entity, cond["pset"]) if cond.get("pset") else [])
-        ksel = c2.selectbox("Key", k_opts,
-                            index=(k_opts.index(cond.get("key")) if cond.get("key") in k_opts else 0),
+        k_opts, k_pos = opts.keys(rule_entity, cond["pset"]) if cond.get("pset") else ([NONE], {})
+        ksel = c2.selectbox("Key", k_opts, index=k_pos.get(cond.get("key"), 0),
                             key=f"key_sel_{rid}_{cond['_id']}")
-        cond["key"] = "" if ksel == "—" else ksel
+        cond["key"] = "" if ksel == NONE else ksel
 
         cond["op"] = c3.selectbox("Op", OPS, index=OPS.index(cond.get("op","equals")),
                                   key=f"op_{rid}_{cond['_id']}")
 
-        v_opts = ["—"] + (_value_options(pset_index, rule_entity, cond["pset"], cond["key"]) if cond.get("pset") and cond.get("key") else [])
-        vsel = c4.selectbox("Value", v_opts,
-                            index=(v_opts.index(cond.get("value")) if cond.get("value") in v_opts else 0),
+        v_opts, v_pos = (opts.values(rule_entity, cond["pset"], cond["key"])
+                         if cond.get("pset") and cond.get("key") else ([NONE], {}))
+        vsel = c4.selectbox("Value", v_opts, index=v_pos.get(cond.get("value"), 0),
                             key=f"val_sel_{rid}_{cond['_id']}")
-        cond["value"] = "" if vsel == "—" else vsel
+        cond["value"] = "" if vsel == NONE else vsel
 
         cond["case"] = c5.selectbox("Case", CASES, index=CASES.index(case_val),
                                     key=f"case_{rid}_{cond['_id']}")
@@ -93,11 +135,47 @@ def _cond_row(rid: str, cond: dict, rule_entity: str, pset_index):
     remove = c6.button("🗑️", key=f"rmc_{rid}_{cond['_id']}", help="Remove condition")
     return cond, remove
 
+# ---------- paging / search ----------
+PAGE_SIZES = [10, 25, 50, 100]
+
+def _rule_summary(rule):
+    ent = rule.get("entity") or "*"
+    conds = ", ".join(f"{c.get('pset','')}.{c.get('key','')} {c.get('op','equals')} {c.get('value','')}"
+                      for c in rule.get("conditions", []) or [])
+    return f"{ent} · {conds or 'no conditions'} · {rule.get('color', {}).get('hex', '')}"
+
+def _rule_matches(i, rule, query, entity):
+    if entity != "Any" and (rule.get("entity") or "*") != entity:
+        return False
+    if not query:
+        return True
+    q = query.casefold().lstrip("#")
+    return q == str(i + 1) or q in _rule_summary(rule).casefold()
+
+def _editing():
+    # ids of the rules whose widgets are shown; every other rule is one summary line
+    return st.session_state.setdefault("rule_editing", set())
+
+def _show_rule(rules, rid):
+    """Clear the search/filter and open rule `rid` for editing, on its page, on the next run."""
+    st.session_state["rule_search"] = ""
+    st.session_state["rule_filter_entity"] = "Any"
+    size = st.session_state.get("rule_page_size", PAGE_SIZES[1])
+    pos = next(i for i, r in enumerate(rules) if r["_id"] == rid)
+    st.session_state["rule_page"] = pos // size + 1
+    _editing().add(rid)
+
 # ---------- main editor ----------
-def rules_editor(rules: list, entity_options=None, pset_index=None):
-    """Returns rules WITH internal _id keys."""
+def rules_editor(rules: list, entity_options=None, pset_index=None, index_key=None):
+    """
+    Returns rules WITH internal _id keys. Only one page of (searchable,
+    filterable) rules is rendered per run, each as a summary line; only the
+    rules opened with Edit get their widgets. `index_key` identifies the
+    pset index (e.g. the model hash) so its dropdown options are built once.
+    """
     st.subheader("Rules")
     rules = _ensure_ids(list(rules or []))
+    opts = _option_index(pset_index, index_key)
 
     # entity choices
     if not entity_options:
@@ -110,12 +188,41 @@ def rules_editor(rules: list, entity_options=None, pset_index=None):
         nr["conditions"] = []
         rules.append(nr)
         st.session_state["rules"] = rules
+        _show_rule(rules, nr["_id"])
         st.rerun()
 
-    # Render rules
-    for i, rule in enumerate(list(rules)):
+    # Search / filter / paging
+    f1, f2, f3 = st.columns([2.2, 1.4, 0.8])
+    query = f1.text_input("Search rules", key="rule_search", placeholder="#, entity, pset, key, value or colour")
+    used = sorted({r.get("entity") or "*" for r in rules})
+    if st.session_state.get("rule_filter_entity", "Any") not in ["Any"] + used:
+        st.session_state["rule_filter_entity"] = "Any"
+    ent_filter = f2.selectbox("Entity filter", ["Any"] + used, key="rule_filter_entity")
+    size = f3.selectbox("Per page", PAGE_SIZES, index=1, key="rule_page_size")
+
+    visible = [i for i, r in enumerate(rules) if _rule_matches(i, r, query, ent_filter)]
+    n_pages = max(1, -(-len(visible) // size))
+    # clamp before the widget exists (the list may have shrunk)
+    st.session_state["rule_page"] = min(max(1, st.session_state.get("rule_page", 1)), n_pages)
+    p1, p2 = st.columns([1, 3])
+    page = p1.number_input("Page", min_value=1, max_value=n_pages, step=1, key="rule_page")
+    p2.caption(f"{len(visible)} of {len(rules)} rules match · page {page} of {n_pages}")
+    editing = _editing()
+
+    # Render only the current page
+    for i in visible[(page - 1) * size: page * size]:
+        rule = rules[i]
         rid = rule["_id"]
-        with st.expander(f"Rule #{i+1}", expanded=True):
+        with st.container(border=True):
+            t1, t2 = st.columns([6, 1])
+            t1.markdown(f"**Rule #{i+1}**")
+            t1.text(_rule_summary(rule))
+            if t2.button("Close" if rid in editing else "✏️ Edit", key=f"edit_{rid}"):
+                editing.symmetric_difference_update({rid})
+                st.rerun()
+            if rid not in editing:
+                continue
+
             h1, h2, h3, h4 = st.columns([1.6, 1.1, 0.9, 0.9])
             # entity dropdown with All (*)
             current = rule.get("entity","IfcGeographicElement")
@@ -139,9 +246,11 @@ def rules_editor(rules: list, entity_options=None, pset_index=None):
                     clone["conditions"].append(nc)
                 rules.insert(i+1, clone)
                 st.session_state["rules"] = rules
+                editing.add(clone["_id"])
                 st.rerun()
 
             if h4.button("🗑️ Delete", key=f"delr_{rid}"):
+                editing.discard(rid)
                 rules.pop(i)
                 st.session_state["rules"] = rules
                 st.rerun()
@@ -150,7 +259,7 @@ def rules_editor(rules: list, entity_options=None, pset_index=None):
             conds = rule.get("conditions", [])
             to_remove = None
             for j, c in enumerate(conds):
-                c, remove = _cond_row(rid, c, rule.get("entity"), pset_index)
+                c, remove = _cond_row(rid, c, rule.get("entity"), opts)
                 conds[j] = c
                 if remove:
                     to_remove = j
@@ -0,0 +1,204 @@
+# app/index_cache.py
+"""
+Model indexes persisted on disk, so a file that was opened before (by this
+process, an earlier run or another app replica sharing the directory) skips
+indexing. One .npz per (content hash, INDEX_VERSION): entity ids as int64
+arrays, strings as one UTF-8 JSON blob; no pickles.
+"""
+import json
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from core.psets import PropertyTables
+from utils.ifc_helpers import StyleGraph
+
+# bump whenever index_model / PropertyTables / StyleGraph output changes
+INDEX_VERSION = 2
+
+def resolved_count(props, styles):
+    """How much has been extracted into `props` / resolved in `styles`; an entry needs rewriting when it grows."""
+    info = {**props.cache_info(), **styles.cache_info()}
+    return info["property_tables"]["misses"] + info["product_styles"]["misses"]
+
+def _csr(rows):
+    """List of int lists -> (offsets, values) arrays."""
+    counts = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    values = np.fromiter((v for r in rows for v in r), dtype=np.int64, count=int(offsets[-1]))
+    return offsets, values
+
+def _rows(offsets, values):
+    values = values.tolist()
+    offsets = offsets.tolist()
+    return [values[a:b] for a, b in zip(offsets, offsets[1:])]
+
+def _ids(a):
+    return np.asarray(a, dtype=np.int64)
+
+class CachedIndex:
+    """
+    What a cache entry restores: PropertyTables, StyleGraph and the
+    index_model() dict built with `params` (None if there is none).
+    """
+    def __init__(self, props, styles, index=None, params=None):
+        self.props = props
+        self.styles = styles
+        self.index = index
+        self.params = params
+
+class IndexCache:
+    """
+    Directory of model index entries, evicted least-recently-used (by file
+    mtime, refreshed on every hit) once they add up to more than `max_bytes`.
+    Writes go through a temp file and an atomic rename, so readers never see
+    a partial entry.
+    """
+    def __init__(self, directory, max_bytes=2 * 1024**3):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, content_hash):
+        return self.directory / f"{content_hash}-v{INDEX_VERSION}.npz"
+
+    def load(self, model, content_hash, params=None):
+        """
+        Return a CachedIndex for `model` (parsed from content with that hash),
+        or None if nothing valid is cached. Its index is None unless it was
+        built with the same `params`.
+        """
+        path = self.path(content_hash)
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                data = {k: z[k] for k in z.files}
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            if meta.get("version") != INDEX_VERSION:
+                return None
+            props = PropertyTables.from_state({
+                "pset_ids": data["pset_ids"].tolist(),
+                "psets": meta["psets"],
+                "element_ids": data["element_ids"].tolist(),
+                "element_psets": _rows(data["element_offsets"], data["element_psets"]),
+            })
+            rend_rows = _rows(data["rend_offsets"], data["rend_ids"])
+            surf_rows = _rows(data["surf_offsets"], data["surf_pairs"])
+            items = [[sid, item, rends, [surf[i:i + 2] for i in range(0, len(surf), 2)]]
+                     for sid, item, rends, surf in zip(data["si_ids"].tolist(), data["si_items"].tolist(),
+                                                       rend_rows, surf_rows)]
+            products = list(zip(data["product_ids"].tolist(), _rows(data["product_offsets"], data["product_sis"])))
+            styles = StyleGraph.from_state(model, {"styled_items": items, "products": products})
+        except (OSError, ValueError, KeyError, RuntimeError, EOFError, zipfile.BadZipFile):
+            # missing, damaged, or not matching this model
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        same = meta.get("params") == params
+        return CachedIndex(props, styles, meta["index"] if same else None, meta["params"])
+
+    def load_index(self, content_hash, params=None):
+        """Just the index_model() dict stored with `params`, without the model; None if there is none."""
+        meta = self._meta(content_hash)
+        if meta is None or meta.get("params") != params:
+            return None
+        return meta["index"]
+
+    def _meta(self, content_hash):
+        try:
+            with np.load(self.path(content_hash), allow_pickle=False) as z:
+                meta = json.loads(z["meta"].tobytes().decode("utf-8"))
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+        return meta if meta.get("version") == INDEX_VERSION else None
+
+    def store(self, content_hash, props, styles, index=None, params=None):
+        """
+        Write the entry for `content_hash` (replacing any previous one), then
+        evict down to max_bytes. `styles` must come from the model as parsed.
+        Without an `index` the previous entry's index (and its params) is kept.
+        """
+        if index is None:
+            old = self._meta(content_hash) or {}
+            index, params = old.get("index"), old.get("params")
+        ps = props.export_state()
+        gs = styles.export_state()
+        items = gs["styled_items"]
+        meta = {"version": INDEX_VERSION, "hash": content_hash, "params": params,
+                "index": index, "psets": ps["psets"]}
+        el_off, el_psets = _csr(ps["element_psets"])
+        rend_off, rend_ids = _csr([row[2] for row in items])
+        surf_off, surf_pairs = _csr([[x for pair in row[3] for x in pair] for row in items])
+        prod_off, prod_sis = _csr([sis for _, sis in gs["products"]])
+        return self._write(content_hash, {
+            "meta": meta,
+            "pset_ids": _ids(ps["pset_ids"]),
+            "element_ids": _ids(ps["element_ids"]), "element_offsets": el_off, "element_psets": el_psets,
+            "si_ids": _ids([row[0] for row in items]), "si_items": _ids([row[1] for row in items]),
+            "rend_offsets": rend_off, "rend_ids": rend_ids,
+            "surf_offsets": surf_off, "surf_pairs": surf_pairs,
+            "product_ids": _ids([pid for pid, _ in gs["products"]]),
+            "product_offsets": prod_off, "product_sis": prod_sis,
+        })
+
+    def store_index(self, content_hash, index, params=None):
+        """
+        Set the index_model() dict (built with `params`) of the entry for
+        `content_hash`, keeping its tables; without an entry, write one with
+        just the index (load() misses on it until store() adds the tables).
+        """
+        try:
+            with np.load(self.path(content_hash), allow_pickle=False) as z:
+                arrays = {k: z[k] for k in z.files}
+            meta = json.loads(arrays["meta"].tobytes().decode("utf-8"))
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            arrays, meta = {}, {}
+        if meta.get("version") != INDEX_VERSION:
+            arrays, meta = {}, {"version": INDEX_VERSION, "hash": content_hash}
+        arrays["meta"] = {**meta, "index": index, "params": params}
+        return self._write(content_hash, arrays)
+
+    def _write(self, content_hash, arrays):
+        arrays["meta"] = np.frombuffer(json.dumps(arrays["meta"], ensure_ascii=False).encode("utf-8"),
+                                       dtype=np.uint8)
+        path = self.path(content_hash)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.chmod(tmp, 0o644)  # mkstemp's 0600 would hide it from other replicas' users
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._evict(keep=path)
+        return path
+
+    def _evict(self, keep=None):
+        entries = []
+        for p in self.directory.glob("*.npz"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
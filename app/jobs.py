@@ -0,0 +1,314 @@
+# app/jobs.py
+"""
+Recolour jobs run off the Streamlit script thread. A JobStore directory
+holds each job's spec, status, progress, result and output file; a
+JobManager runs the jobs on in-process threads or in worker processes.
+Either way a bounded ModelPool keeps parsed models warm, keyed by content
+hash, with one RecolorSession per model that every job reverts when done,
+so the next job (of any user) starts from the file as uploaded.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from core.io_ifc import open_ifc, save_ifc_patched
+from core.colorize import RecolorSession
+from core.rules import compile_rules
+from core.psets import PropertyTables
+from app.model_cache import ModelPool
+from app.index_cache import IndexCache, resolved_count
+from utils.ifc_helpers import StyleGraph
+from utils.profiling import Profiler
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+KINDS = ("dry_run", "apply")
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+class JobStore:
+    """
+    jobs/<id>/job.json (spec, status, progress, result) plus the job's output
+    files, and models/<hash>.ifc with each source file stored once. Files
+    are replaced atomically, so a poller in any process never reads a
+    partial one. Only the worker running a job writes its job.json; a
+    cancel request is a separate marker file.
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        (self.directory / "jobs").mkdir(parents=True, exist_ok=True)
+        (self.directory / "models").mkdir(parents=True, exist_ok=True)
+
+    def source_path(self, content_hash):
+        return self.directory / "models" / f"{content_hash}.ifc"
+
+    def put_source(self, content_hash, data):
+        """Store the file for `content_hash` unless it is there already; returns its path."""
+        path = self.source_path(content_hash)
+        if path.exists():
+            os.utime(path)
+        else:
+            _write_atomic(path, data)
+        return path
+
+    def path(self, job_id, name="job.json"):
+        return self.directory / "jobs" / job_id / name
+
+    def create(self, spec):
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "status": QUEUED, "created": time.time(), **spec}
+        # the job dir appears with its job.json in it: prune() never sees it empty
+        tmp = Path(tempfile.mkdtemp(dir=self.directory / "jobs", prefix=".new-"))
+        try:
+            _write_atomic(tmp / "job.json", json.dumps(job, ensure_ascii=False).encode("utf-8"))
+            os.chmod(tmp, 0o755)
+            os.rename(tmp, self.path(job_id).parent)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return job
+
+    def get(self, job_id):
+        """The job's current record, or None if there is no such job."""
+        try:
+            return json.loads(self.path(job_id).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **changes):
+        """Apply `changes` to the job's record; KeyError if there is no such job."""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        job.update(changes)
+        self._write(job)
+        return job
+
+    def _write(self, job):
+        _write_atomic(self.path(job["id"]), json.dumps(job, ensure_ascii=False).encode("utf-8"))
+
+    def cancel(self, job_id):
+        self.path(job_id, "cancel").touch()
+
+    def cancelled(self, job_id):
+        return self.path(job_id, "cancel").exists()
+
+    def prune(self, max_age=24 * 3600):
+        """Delete finished jobs and source files not used for `max_age` seconds."""
+        cutoff = time.time() - max_age
+        for d in (self.directory / "jobs").iterdir():
+            job = self.get(d.name)
+            if job is None:
+                # unreadable, or a create() interrupted before its rename
+                try:
+                    stale = d.stat().st_mtime < cutoff
+                except OSError:
+                    continue
+            else:
+                stale = job["status"] in FINISHED and job.get("finished", 0) < cutoff
+            if stale:
+                shutil.rmtree(d, ignore_errors=True)
+        for p in (self.directory / "models").glob("*.ifc"):
+            try:
+                if p.stat().st_mtime < cutoff:
+                    p.unlink()
+            except OSError:
+                pass
+
+def _session(entry, index_cache, snap):
+    def build():
+        cached = IndexCache(index_cache).load(entry.model, entry.key) if index_cache else None
+        props = cached.props if cached is not None else PropertyTables()
+        styles = cached.styles if cached is not None else StyleGraph(entry.model)
+        return RecolorSession(entry.model, props=props, styles=styles, snap_metric="delta_e")
+    sess = entry.get_or_build("session", build)
+    if sess.snap != (snap or None):
+        # a different snap threshold needs a fresh colour registry
+        sess.snap = snap or None
+        sess.colours = None
+    return sess
+
+def _persist(entry, sess, index_cache):
+    """Save what the job resolved (more tables, product styles) to the index cache, keeping the editor's index."""
+    count = resolved_count(sess.props, sess.styles)
+    if index_cache and entry.extras.get("persisted", 0) != count:
+        IndexCache(index_cache).store(entry.key, sess.props, sess.styles)
+        entry.extras["persisted"] = count
+
+def _write_profile(store, job_id, prof):
+    store.path(job_id, "profile.json").write_text(prof.to_json(), encoding="utf-8")
+    store.path(job_id, "speedscope.json").write_text(json.dumps(prof.to_speedscope()), encoding="utf-8")
+
+def run_job(store, job_id, pool, index_cache=None, progress_every=0.5):
+    """Run one queued job to completion, recording progress and the outcome in the store."""
+    try:
+        job = store.update(job_id, status=RUNNING, started=time.time(), pid=os.getpid())
+        if store.cancelled(job_id):
+            store.update(job_id, status=CANCELLED, finished=time.time())
+            return
+        plan = compile_rules(job["rules"])
+        source = store.source_path(job["hash"])
+        entry = pool.get_or_open(job["hash"], lambda: open_ifc(source), size=source.stat().st_size)
+        # one job per model at a time: the session and the model are shared
+        with entry.get_or_build("job_lock", threading.Lock):
+            sess = _session(entry, index_cache, job.get("snap"))
+            prof = Profiler() if job.get("profile") else None
+            result = {}
+            if job["kind"] == "dry_run" and prof is None:
+                last = 0
+                for prog in sess.iter_dry_run(plan, batch_size=500):
+                    if store.cancelled(job_id):
+                        store.update(job_id, status=CANCELLED, finished=time.time(), progress=prog)
+                        return
+                    if prog["finished"] or time.monotonic() - last >= progress_every:
+                        store.update(job_id, progress=prog)
+                        last = time.monotonic()
+                result["progress"] = prog
+            elif job["kind"] == "dry_run":
+                result["stats"] = sess.run(plan, dry_run=True, profile=prof)
+            else:
+                model, stats = sess.run(plan, split_shared=job.get("split_shared", False), profile=prof)
+                try:
+                    entry.extras["step_offsets"] = save_ifc_patched(
+                        model, store.path(job_id, "output.ifc"), source, *sess.journal(),
+                        offsets=entry.extras.get("step_offsets"))
+                finally:
+                    # the pooled model goes back to the file as uploaded for the next job
+                    sess.revert()
+                result["stats"] = stats
+            if prof is not None:
+                _write_profile(store, job_id, prof)
+            _persist(entry, sess, index_cache)
+        store.update(job_id, status=DONE, finished=time.time(), result=result)
+    except Exception as e:
+        try:
+            store.update(job_id, status=FAILED, finished=time.time(), error=f"{type(e).__name__}: {e}")
+        except (KeyError, OSError):
+            pass  # the record itself is gone or unwritable: nothing left to report to
+
+def _worker_main(directory, jobs, max_models, max_bytes, index_cache):
+    store = JobStore(directory)
+    pool = ModelPool(max_models=max_models, max_bytes=max_bytes)
+    while True:
+        job_id = jobs.get()
+        if job_id is None:
+            return
+        run_job(store, job_id, pool, index_cache)
+
+class JobManager:
+    """
+    Runs dry-run and apply jobs in the background; submit() returns a job id
+    to poll with status().
+
+    mode "thread": `workers` threads in this process share one ModelPool.
+    mode "process": `workers` processes, each with its own queue and
+    ModelPool (`max_models` / `max_bytes` each); jobs are routed by content
+    hash, so repeated jobs on a file find it parsed. A worker that dies is
+    restarted and its running job reported failed.
+    `index_cache` is an IndexCache directory shared with the app and CLI.
+    """
+    def __init__(self, directory, workers=2, mode="process", max_models=2, max_bytes=4 * 1024**3,
+                 index_cache=None, max_age=24 * 3600):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"unknown job mode {mode!r}")
+        self.store = JobStore(directory)
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.index_cache = index_cache
+        self.max_age = max_age
+        self._limits = (max_models, max_bytes)
+        self._lock = threading.Lock()
+        if mode == "thread":
+            self._pool = ModelPool(max_models=max_models, max_bytes=max_bytes)
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="recolor-job")
+        else:
+            # spawn: the app's process has threads, which fork does not carry over safely
+            self._ctx = multiprocessing.get_context("spawn")
+            self._queues = [self._ctx.Queue() for _ in range(self.workers)]
+            self._procs = [None] * self.workers
+
+    def _start(self, i):
+        proc = self._ctx.Process(target=_worker_main, daemon=True, name=f"recolor-worker-{i}",
+                                 args=(str(self.store.directory), self._queues[i], *self._limits,
+                                       self.index_cache))
+        proc.start()
+        self._procs[i] = proc
+
+    def _worker(self, content_hash):
+        i = zlib.crc32(content_hash.encode("utf-8")) % self.workers
+        with self._lock:
+            if self._procs[i] is None or not self._procs[i].is_alive():
+                self._start(i)
+        return i
+
+    def _alive(self, pid):
+        with self._lock:
+            # is_alive() also reaps a dead worker, which os.kill(pid, 0) would still see
+            return any(p is not None and p.pid == pid and p.is_alive() for p in self._procs)
+
+    def submit(self, kind, content_hash, data, rules, **options):
+        """
+        Queue a `kind` job ("dry_run" or "apply") of `rules` on the file
+        `data` (bytes, stored once per `content_hash`). `options`:
+        split_shared, snap, profile. Bad rules raise ValueError here.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"unknown job kind {kind!r}")
+        compile_rules(rules)
+        self.store.prune(self.max_age)
+        self.store.put_source(content_hash, data)
+        job = self.store.create({"kind": kind, "hash": content_hash, "rules": rules, **options})
+        if self.mode == "thread":
+            self._executor.submit(run_job, self.store, job["id"], self._pool, self.index_cache)
+        else:
+            self._queues[self._worker(content_hash)].put(job["id"])
+        return job["id"]
+
+    def status(self, job_id):
+        """The job's record: status, progress (dry runs), result or error; None if unknown."""
+        job = self.store.get(job_id)
+        if job is None or self.mode == "thread":
+            return job
+        if job["status"] == RUNNING and not self._alive(job["pid"]):
+            job = self.store.update(job_id, status=FAILED, finished=time.time(), error="worker process died")
+        elif job["status"] == QUEUED:
+            # a replacement worker picks up what was queued for a dead one
+            self._worker(job["hash"])
+        return job
+
+    def cancel(self, job_id):
+        """Ask a queued or running dry run to stop (applies finish once started)."""
+        self.store.cancel(job_id)
+
+    def output_path(self, job_id, name="output.ifc"):
+        return self.store.path(job_id, name)
+
+    def shutdown(self):
+        if self.mode == "thread":
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            return
+        for q in self._queues:
+            q.put(None)
+        for proc in self._procs:
+            if proc is not None:
+                proc.join(timeout=5)
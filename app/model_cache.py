@@ -0,0 +1,81 @@
+# app/model_cache.py
+import threading
+from collections import OrderedDict
+
+# Parsed ifcopenshell models take several times the size of the IFC text.
+MODEL_SIZE_FACTOR = 6
+
+class ModelEntry:
+    """A parsed model plus anything derived from it (indexes, lookup tables)."""
+    def __init__(self, key, model, size):
+        self.key = key
+        self.model = model
+        self.size = size
+        self.extras = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, name, build):
+        """Return extras[name], computing it once with build() if missing."""
+        with self._lock:
+            if name not in self.extras:
+                self.extras[name] = build()
+            return self.extras[name]
+
+class ModelPool:
+    """
+    Parsed models keyed by content hash, evicted least-recently-used once
+    there are more than `max_models` or their estimated memory
+    (file size * MODEL_SIZE_FACTOR) exceeds `max_bytes`. The newest model
+    is always kept, however large. Thread-safe; a model is parsed once
+    even if several sessions ask for it at the same time.
+    """
+    def __init__(self, max_models=4, max_bytes=4 * 1024**3):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_or_open(self, key, open_model, size=0):
+        """Return the entry for `key`, calling open_model() to parse it on a miss."""
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            entry = self.get(key)
+            if entry is None:
+                entry = ModelEntry(key, open_model(), size)
+                self.put(entry)
+        with self._lock:
+            self._loading.pop(key, None)
+        return entry
+
+    def put(self, entry):
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._entries.move_to_end(entry.key)
+            self._evict()
+
+    def pop(self, key):
+        """Remove and return an entry (e.g. before mutating its model in place)."""
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def _evict(self):
+        def used():
+            return sum(e.size * MODEL_SIZE_FACTOR for e in self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.max_models or used() > self.max_bytes):
+            self._entries.popitem(last=False)
@@ -5,45 +5,151 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+import os
 import json
-import hashlib
+import tempfile
 import streamlit as st
 
-from core.io_ifc import open_ifc_from_bytes, save_ifc_to_bytes
-from core.colorize import recolor_with_rules
-from core.psets import build_pset_index, discover_entity_types
+from core.io_ifc import open_ifc_from_file
+from core.step import scan_index
+from core.rules import compile_rules, _strip_internal
+from core.psets import index_model
 from app.components.rule_editor import rules_editor
+from app.index_cache import IndexCache
+from app.jobs import JobManager, QUEUED, DONE, FAILED, CANCELLED, FINISHED
+from utils.hashing import hash_stream
 
 st.set_page_config(page_title="IFC Recolour", layout="wide")
 
-def _strip_internal(obj):
-    if isinstance(obj, dict):
-        return {k: _strip_internal(v) for k, v in obj.items() if not str(k).startswith("_")}
-    if isinstance(obj, list):
-        return [_strip_internal(x) for x in obj]
-    return obj
-
-def _load_ifc(upload):
-    if not upload:
-        return None, None
-    data = upload.read()
-    model = open_ifc_from_bytes(data)
-    return data, model
-
-def _ifc_hash(data: bytes | None) -> str:
-    if not data:
-        return "no-ifc"
-    return hashlib.md5(data).hexdigest()
-
-@st.cache_data(show_spinner=False)
-def _cached_discover_entity_types(ifc_bytes_hash: str, *, ifc_bytes: bytes):
-    model = open_ifc_from_bytes(ifc_bytes)
-    return discover_entity_types(model)
-
-@st.cache_data(show_spinner=False)
-def _cached_build_pset_index(ifc_bytes_hash: str, entity_types: list[str], *, ifc_bytes: bytes):
-    model = open_ifc_from_bytes(ifc_bytes)
-    return build_pset_index(model, entity_types=entity_types, max_elements=30000, limit_values=1000)
+# st.fragment before Streamlit 1.37
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+# what the rule editor needs; part of the on-disk index cache entry
+INDEX_PARAMS = {"entity_types": [], "include_concrete": True, "max_elements": 30000, "limit_values": 1000}
+
+@st.cache_resource(show_spinner=False)
+def _index_cache():
+    # point replicas at one shared directory to share indexes between them
+    directory = os.environ.get("IFC_RECOLOUR_INDEX_CACHE",
+                               os.path.join(tempfile.gettempdir(), "ifcrecolour-index"))
+    return IndexCache(directory, max_bytes=int(os.environ.get("IFC_RECOLOUR_INDEX_CACHE_BYTES", 2 * 1024**3)))
+
+@st.cache_resource(show_spinner=False)
+def _jobs():
+    # shared by all sessions: runs never block a session's script thread, and models stay parsed between runs
+    directory = os.environ.get("IFC_RECOLOUR_JOBS", os.path.join(tempfile.gettempdir(), "ifcrecolour-jobs"))
+    return JobManager(directory, workers=int(os.environ.get("IFC_RECOLOUR_JOB_WORKERS", 2)),
+                      mode=os.environ.get("IFC_RECOLOUR_JOB_MODE", "process"),
+                      index_cache=str(_index_cache().directory))
+
+def _upload_index(ihash, upload):
+    """
+    The rule editor's index for an upload without parsing it: from the disk
+    cache, else a scan of the STEP text that skips geometry.
+    """
+    index = _index_cache().load_index(ihash, INDEX_PARAMS)
+    if index is None:
+        try:
+            index = scan_index(upload.getvalue(), **INDEX_PARAMS)
+        except ValueError:
+            # not STEP text the scanner can read: index the parsed model instead
+            upload.seek(0)
+            index = index_model(open_ifc_from_file(upload), **INDEX_PARAMS)
+        # jobs add their property tables / style maps to the same entry and keep this
+        _index_cache().store_index(ihash, index, INDEX_PARAMS)
+    return index
+
+def _submit(kind, rules, **options):
+    """Queue a job on the current upload; returns its id."""
+    upload = st.session_state["ifc_file"]
+    return _jobs().submit(kind, st.session_state["ifc_hash"], upload.getvalue(), rules, **options)
+
+def _show_profile(data, job_id):
+    """Per-phase / per-rule / cache breakdown of a profiled job, with its exports."""
+    st.markdown("**Profile**")
+    st.dataframe([{"phase": k, **v} for k, v in data["phases"].items()], use_container_width=True)
+    st.dataframe([{"rule": int(k) + 1, **v} for k, v in data["rules"].items()], use_container_width=True)
+    st.dataframe([{"cache": k, **v} for k, v in data["caches"].items()], use_container_width=True)
+    p1, p2 = st.columns(2)
+    with p1, open(_jobs().output_path(job_id, "profile.json"), "rb") as f:
+        st.download_button("Download profile.json", data=f, file_name="profile.json",
+                           mime="application/json", key=f"profile_{job_id}")
+    with p2, open(_jobs().output_path(job_id, "speedscope.json"), "rb") as f:
+        st.download_button("Download speedscope trace", data=f, file_name="recolor.speedscope.json",
+                           mime="application/json", key=f"speedscope_{job_id}")
+
+def _rule_label(rule):
+    conds = " and ".join(f"{c.get('pset', '')}.{c.get('key', '')} {c.get('op', 'equals')} {c.get('value', '')!r}"
+                         for c in rule.get("conditions", []) or [])
+    return f"{rule.get('entity') or '*'}: {conds or '(no conditions)'}"
+
+def _hex(rgb):
+    return "#" + "".join(f"{round(v * 255):02X}" for v in rgb)
+
+def _match_table(plan, prog):
+    rows = []
+    # job progress comes back as JSON: rule indices are strings
+    for i, hit in sorted((int(k), v) for k, v in prog["rules"].items()):
+        rule = plan.rules[i]
+        rows.append({"rule": i + 1, "match": _rule_label(rule.rule), "colour": _hex(rule.rgb),
+                     "hits": hit["hits"], "sample GlobalIds": ", ".join(hit["samples"])})
+    return rows
+
+def _show_dry_run(plan, prog):
+    total = prog["total"] or 1
+    if prog.get("phase") == "indexing":
+        st.progress(prog["done"] / total, text=f"Indexing properties: {prog['done']}/{prog['total']} elements")
+        return
+    st.progress(prog["done"] / total,
+                text=f"{prog['done']}/{prog['total']} elements checked, {prog['matched']} matched, "
+                     f"{prog['changed_styles']} styles on {prog['touched_elements']} elements")
+    st.dataframe(_match_table(plan, prog), use_container_width=True)
+
+@_fragment(run_every=1)
+def _poll_job(job_id, plan):
+    """A queued or running job, refreshed every second; the whole page reruns once it finishes."""
+    job = _jobs().status(job_id)
+    if job is None or job["status"] in FINISHED:
+        st.rerun()
+    if job.get("progress"):
+        _show_dry_run(plan, job["progress"])
+    else:
+        st.info("Queued…" if job["status"] == QUEUED else "Running…")
+    if job["kind"] == "dry_run" and st.button("Cancel dry-run", key=f"cancel_{job_id}"):
+        _jobs().cancel(job_id)
+
+def _job_panel(job_id, plan):
+    """A job's outcome, or its live progress while it is not finished."""
+    job = _jobs().status(job_id)
+    if job is None:
+        return  # pruned
+    if job["status"] not in FINISHED:
+        _poll_job(job_id, plan)
+        return
+    if job["status"] == FAILED:
+        st.error(f"Job failed: {job['error']}")
+        return
+    result = job.get("result", {})
+    stats = result.get("stats", {})
+    if job["kind"] == "dry_run":
+        prog = job.get("progress")
+        if job["status"] == CANCELLED and prog:
+            step = "indexed" if prog.get("phase") == "indexing" else "checked"
+            st.warning(f"Dry-run cancelled after {prog['done']} of {prog['total']} elements {step}.")
+        if prog:
+            _show_dry_run(plan, prog)
+        elif stats:
+            st.json({k: v for k, v in stats.items() if k != "profile"})
+    elif job["status"] == DONE:
+        with open(_jobs().output_path(job_id), "rb") as f:
+            st.download_button("Download recolored.ifc", data=f, file_name="recolored.ifc",
+                               mime="application/octet-stream", key=f"download_{job_id}")
+        st.success(
+            f"Changed {stats.get('changed_styles','?')} styles on "
+            f"{stats.get('touched_elements','?')} elements."
+        )
+    if stats.get("profile"):
+        _show_profile(stats["profile"], job_id)
 
 # ---------- Rules upload handler with versioned key ----------
 def _handle_rules_upload(upload_key: str):
@@ -66,44 +172,35 @@ def main():
 
     # IFC upload
     up = st.file_uploader("Upload IFC", type=["ifc"], key="ifc_upload")
-    if up:
-        data, model = _load_ifc(up)
-        st.session_state["ifc_bytes"] = data
-        st.session_state["ifc_model"] = model
-        st.session_state.pop("entity_types", None)
-        st.session_state.pop("pset_index", None)
+    if up and up.file_id != st.session_state.get("ifc_file_id"):
+        # the hash is taken once, in chunks, and keys every cache; nothing re-hashes on reruns
+        up.seek(0)
+        ihash = hash_stream(up)
+        up.seek(0)
+        with st.spinner("Indexing entity types and property sets…"):
+            index = _upload_index(ihash, up)
+        st.session_state["ifc_file_id"] = up.file_id
+        # kept past the uploader being cleared: the model may still need parsing / patching from it
+        st.session_state["ifc_file"] = up
+        st.session_state["ifc_hash"] = ihash
+        st.session_state["ifc_index"] = index
+        # jobs of the previous file
+        for key in ("dry_run_job", "apply_job"):
+            st.session_state.pop(key, None)
         st.success("IFC loaded.")
 
-    model = st.session_state.get("ifc_model")
-    if not model:
+    index = st.session_state.get("ifc_index")
+    if index is None:
         st.info("Upload an IFC file to get started.")
         return
 
-    ifc_bytes = st.session_state.get("ifc_bytes")
-    ihash = _ifc_hash(ifc_bytes)
-
     # Quick counts
-    try:
-        prod_count = len(model.by_type("IfcProduct"))
-    except Exception:
-        prod_count = "n/a"
-    try:
-        geo_count = len(model.by_type("IfcGeographicElement"))
-    except Exception:
-        geo_count = "n/a"
-    st.write(f"IfcProduct count: {prod_count}")
-    st.write(f"IfcGeographicElement count: {geo_count}")
-
-    # Discover/build (cached)
-    if "entity_types" not in st.session_state:
-        with st.spinner("Discovering entity types…"):
-            st.session_state["entity_types"] = _cached_discover_entity_types(ihash, ifc_bytes=ifc_bytes)
-    entity_types = st.session_state["entity_types"]
-
-    if "pset_index" not in st.session_state:
-        with st.spinner("Indexing property sets…"):
-            st.session_state["pset_index"] = _cached_build_pset_index(ihash, entity_types, ifc_bytes=ifc_bytes)
-    pset_index = st.session_state["pset_index"]
+    counts = index.get("type_counts", {})
+    st.write(f"IfcProduct count: {counts.get('IfcProduct', 'n/a')}")
+    st.write(f"IfcGeographicElement count: {counts.get('IfcGeographicElement', 'n/a')}")
+
+    entity_types = index["entity_types"]
+    pset_index = index["pset_index"]
 
     tab_rules, tab_apply = st.tabs(["🧩 Rules", "🎨 Apply & Export"])
 
@@ -111,7 +208,8 @@ def main():
         rules = st.session_state.get("rules", [])
         entity_options = ["All (*)"] + entity_types
 
-        rules = rules_editor(rules, entity_options=entity_options, pset_index=pset_index)
+        rules = rules_editor(rules, entity_options=entity_options, pset_index=pset_index,
+                             index_key=st.session_state.get("ifc_hash"))
         st.session_state["rules"] = rules
 
         c1, c2 = st.columns(2)
@@ -140,25 +238,43 @@ def main():
         if not rules:
             st.info("Define at least one rule in the Rules tab.")
         else:
+            # compile once: bad regexes / colours are reported before any run
+            try:
+                plan = compile_rules(rules)
+            except ValueError as e:
+                st.error(f"Invalid rules: {e}")
+                return
+            split = st.checkbox(
+                "Split shared styles (copy-on-write)",
+                key="split_shared",
+                help="Elements that share one style but match different rules get their own "
+                     "style copy per colour instead of the last rule winning for all of them.",
+            )
+            snap = st.number_input(
+                "Snap near-duplicate colours (ΔE, 0 = off)",
+                min_value=0.0, max_value=20.0, value=0.0, step=0.5, key="snap_delta_e",
+                help="Rule colours closer than this to an existing colour reuse it instead of "
+                     "adding another IfcColourRgb.",
+            )
+            profile = st.checkbox(
+                "Collect profile",
+                key="collect_profile",
+                help="Time each phase, every rule evaluation and the lookup caches of the next run.",
+            )
+            options = {"snap": snap or None, "profile": profile}
             cc1, cc2 = st.columns(2)
             with cc1:
                 if st.button("Dry-run (show matches)"):
-                    stats = recolor_with_rules(model, rules, dry_run=True)
-                    st.json(stats)
+                    # shown only while the rules are unchanged: its per-rule counts follow plan order
+                    st.session_state["dry_run_job"] = (plan.keys, _submit("dry_run", rules, **options))
             with cc2:
                 if st.button("Apply recolor and prepare download"):
-                    changed_model, stats = recolor_with_rules(model, rules, dry_run=False)
-                    out_bytes = save_ifc_to_bytes(changed_model)
-                    st.download_button(
-                        "Download recolored.ifc",
-                        data=out_bytes,
-                        file_name="recolored.ifc",
-                        mime="application/octet-stream",
-                    )
-                    st.success(
-                        f"Changed {stats.get('changed_styles','?')} styles on "
-                        f"{stats.get('touched_elements','?')} elements."
-                    )
+                    st.session_state["apply_job"] = _submit("apply", rules, split_shared=split, **options)
+            dry = st.session_state.get("dry_run_job")
+            if dry is not None and dry[0] == plan.keys:
+                _job_panel(dry[1], plan)
+            if st.session_state.get("apply_job"):
+                _job_panel(st.session_state["apply_job"], plan)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,177 @@
+# bench/equivalence.py
+"""
+Check that the fast paths still give the reference results on synthetic models,
+and that malformed input is rejected the documented way:
+
+    rules       bad rules raise ValueError from compile_rules (the CLI's exit code 2)
+    parallel    core.parallel.parallel_match vs matching in this process
+    step        core.step.StepOffsets on files with a missing final ';' or trailing junk
+    scan        core.step.scan_index vs core.psets.index_model of the parsed file, with
+                record starts inside strings and comments
+    caps        capped index_model samples are the first elements of the IfcProduct walk
+
+    python -m bench.equivalence
+    python -m bench.equivalence --checks parallel --seeds 0 1 2 --workers 4
+
+Run it after upgrading ifcopenshell. Exit code 1 on any difference.
+"""
+import argparse
+import sys
+import time
+
+import ifcopenshell
+
+from bench.synthetic import make_model, make_varied_model, species_rules, varied_rules
+from core.colorize import RecolorSession, _gather_targets
+from core.parallel import PARALLEL_MIN_ELEMENTS, parallel_match
+from core.psets import PropertyTables, index_model
+from core.rules import compile_rules
+from core.step import StepOffsets, iter_patched, scan_index
+
+SCHEMAS = ("IFC2X3", "IFC4", "IFC4X3_ADD2")
+
+def _winners(matches):
+    return {eid: rule.index for eid, rule in matches.items()}
+
+def check_parallel(seed, workers):
+    """Yield a message per difference between parallel and serial matching."""
+    cases = [(f"{schema} varied", make_varied_model(PARALLEL_MIN_ELEMENTS, schema=schema, seed=seed), varied_rules())
+             for schema in SCHEMAS]
+    cases.append(("species", make_model(PARALLEL_MIN_ELEMENTS, psets_per_element=2), species_rules()))
+    for name, model, rules in cases:
+        plan = compile_rules(rules)
+        targets = _gather_targets(model, plan)
+        sess = RecolorSession(model)
+        serial = _winners(sess.match_all(plan, targets))
+        parallel = _winners(parallel_match(plan, targets, sess.props, workers))
+        if serial != parallel:
+            diff = sorted(eid for eid in serial.keys() | parallel.keys() if serial.get(eid) != parallel.get(eid))
+            yield f"{name}: {len(diff)} elements differ, e.g. #{diff[0]}: {serial.get(diff[0])} vs {parallel.get(diff[0])}"
+        stats = RecolorSession(model, workers=workers).run(plan, dry_run=True)
+        expected = RecolorSession(model).run(plan, dry_run=True)
+        if stats != expected:
+            yield f"{name}: dry-run stats differ: {stats} vs {expected}"
+
+# each of these made the statement regex backtrack exponentially at one point
+BAD_TAILS = (b"END-ISO-10303-21", b"END-ISO-10303-21;\n" + b"junk /* c */ a/b 'x' " * 20,
+             b"\n'unterminated " + b"x" * 10000, b"/* open comment" * 100, b"a/*b*/c/*d*/e" * 20)
+
+def check_step(seed, workers):
+    """Yield a message per StepOffsets result that changes (or takes over a second) with a bad file tail."""
+    for schema in SCHEMAS:
+        model = make_varied_model(schema=schema, seed=seed)
+        data = model.to_string().encode("utf-8")
+        offsets = StepOffsets.scan(data)
+        if b"".join(iter_patched(model, data, offsets)) != data:
+            yield f"{schema}: unpatched copy differs from the file"
+        body = data[:data.rindex(b"END-ISO-10303-21;")]
+        for tail in BAD_TAILS:
+            t = time.perf_counter()
+            bad = StepOffsets.scan(body + tail)
+            seconds = time.perf_counter() - t
+            same = ((bad.ids == offsets.ids).all() and (bad.ends == offsets.ends).all()
+                    and bad.data_end == offsets.data_end)
+            if not same or seconds > 1:
+                yield f"{schema}: tail {tail[:24]!r}: {'same' if same else 'different'} offsets in {seconds:.2f}s"
+
+# the app's parameters, the defaults, and explicit types including a supertype and a non-product
+SCAN_PARAMS = ({"entity_types": [], "include_concrete": True}, {},
+               {"entity_types": ["IfcWall", "IfcBuildingElement", "IfcPropertySet"]})
+
+# record starts spelled out in string values and in a comment, which scan_index must not take for records
+PHANTOM_NAME = "x'; #999991=IFCWALL('0000000000000000000000',$,$,$,$,$,$,$,$);"
+PHANTOM_DESCRIPTION = "/* #999992=IFCPROPERTYSET('0000000000000000000000',$,'Phantom',$,(#1));"
+PHANTOM_COMMENT = "/* it's #999993=IFCWALL('0000000000000000000000',$,$,$,$,$,$,$,$); */"
+
+def check_scan(seed, workers):
+    """Yield a message per index_model() output scan_index() gets wrong (no cap is reached here)."""
+    for schema in SCHEMAS:
+        model = make_varied_model(schema=schema, seed=seed)
+        products = model.by_type("IfcProduct")
+        products[0].Name = PHANTOM_NAME
+        products[1].Description = PHANTOM_DESCRIPTION
+        text = model.to_string().replace("DATA;", "DATA;\n" + PHANTOM_COMMENT, 1)
+        model = ifcopenshell.file.from_string(text)
+        for params in SCAN_PARAMS:
+            scanned = scan_index(text.encode("utf-8"), **params)
+            parsed = index_model(model, **params)
+            for key in parsed:
+                if scanned.get(key) != parsed[key]:
+                    yield f"{schema} {params}: {key} differs: {str(scanned.get(key))[:200]} vs {str(parsed[key])[:200]}"
+
+GOOD_CONDITION = {"pset": "P", "key": "K", "op": "equals", "value": "v"}
+GOOD_COLOR = {"hex": "#ff0000"}
+BAD_RULES = [
+    [{"entity": "*", "conditions": [GOOD_CONDITION], "color": color}]
+    for color in ({"hex": 5}, "#ff0000", ["#ff0000"], {"rgb": "red"}, {"rgb": [1, 2]}, {"hex": "#zz0000"}, {})
+] + [
+    [{"entity": "*", "conditions": conditions, "color": GOOD_COLOR}]
+    for conditions in ("abc", ["x"], {"pset": "P"}, [{**GOOD_CONDITION, "op": "like"}],
+                       [{**GOOD_CONDITION, "op": ["equals"]}], [{**GOOD_CONDITION, "pset": 3}],
+                       [{**GOOD_CONDITION, "key": ["K"]}], [{**GOOD_CONDITION, "op": "regex", "value": "("}])
+] + [
+    [{"entity": entity, "conditions": [GOOD_CONDITION], "color": GOOD_COLOR}] for entity in (5, ["IfcWall"])
+] + [{}, "", 0, "rules", {"Raublattaster": [0.3, 0.3, 0.2]}, ["x"], [None]]
+
+def check_rules(seed, workers):
+    """Yield a message per malformed rules list that compiles, or fails with something other than ValueError."""
+    for rules in BAD_RULES:
+        try:
+            compile_rules(rules)
+        except ValueError:
+            continue
+        except Exception as e:
+            yield f"{rules!r}: {type(e).__name__}: {e}"
+        else:
+            yield f"{rules!r}: accepted"
+
+def check_caps(seed, workers):
+    """Yield a message per capped index_model() output that is not the first elements of by_type("IfcProduct")."""
+    for schema in SCHEMAS:
+        model = ifcopenshell.file.from_string(make_varied_model(schema=schema, seed=seed).to_string())
+        props = PropertyTables()
+        walk = model.by_type("IfcProduct")
+        names = []
+        for e in walk:
+            for entry in props.table(e):
+                if entry.name and entry.name not in names and len(names) < 2:
+                    names.append(entry.name)
+        got = index_model(model, entity_types=[], survey_types=(), max_psets=2)["pset_names"]
+        if got != sorted(names):
+            yield f"{schema}: pset_names with max_psets=2: {got} vs {sorted(names)}"
+        types = ["IfcWall", "IfcBuildingElementProxy", "IfcProduct"]
+        expected = {}
+        for et in types:
+            for e in [e for e in walk if e.is_a(et)][:7]:
+                for entry in props.table(e):
+                    for key, vals in entry.props.items():
+                        if entry.name and key:
+                            expected.setdefault(et, {}).setdefault(entry.name, {}).setdefault(key, set()).update(vals)
+        expected = {et: {ps: {k: sorted(v) for k, v in keys.items()} for ps, keys in psets.items()}
+                    for et, psets in expected.items()}
+        got = index_model(model, entity_types=types, max_elements=7)["pset_index"]
+        if got != expected:
+            yield f"{schema}: pset_index with max_elements=7 differs for {sorted(et for et in types if got.get(et) != expected.get(et))}"
+
+CHECKS = {"rules": check_rules, "caps": check_caps, "parallel": check_parallel, "step": check_step, "scan": check_scan}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.equivalence", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--checks", nargs="+", choices=sorted(CHECKS), default=sorted(CHECKS))
+    ap.add_argument("--seeds", type=int, nargs="+", default=[0])
+    ap.add_argument("--workers", type=int, default=2)
+    args = ap.parse_args(argv)
+
+    failed = 0
+    for name in args.checks:
+        for seed in args.seeds:
+            problems = list(CHECKS[name](seed, args.workers))
+            for p in problems:
+                print(f"{name} seed={seed}: {p}", file=sys.stderr)
+            print(f"{name:10} seed={seed}: {'FAIL' if problems else 'ok'}", file=sys.stderr)
+            failed += bool(problems)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
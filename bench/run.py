@@ -0,0 +1,221 @@
+# bench/run.py
+"""
+Benchmark the core functions on synthetic models.
+
+    python -m bench.run --sizes 1000 10000 --out bench/results/latest.json
+    python -m bench.run --psets-per-element 1 4 16 --material-assocs 0 100 --cases index_model scan_index
+    python -m bench.run --baseline bench/baseline.json --threshold 0.25
+    python -m bench.run --save-baseline bench/baseline.json
+
+Every case runs in a fresh process; its peak memory is counted from after the
+synthetic model is built (case_rss_mb is the growth over that). Results are
+JSON; with --baseline the run fails (exit 1) if a case got slower than the
+baseline by more than --threshold (relative).
+"""
+import argparse
+import json
+import gc
+import itertools
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# open_index_model is what scan_index replaces: parse the file, then index_model() it
+CASES = ("open_ifc_from_bytes", "save_ifc_to_bytes", "build_pset_index", "index_model",
+         "open_index_model", "scan_index", "recolor_dry_run", "recolor_apply")
+
+SCENARIOS = {
+    # name: make_model() keyword arguments (n_elements is added per size)
+    "unique_styles": {"shared_styles": False, "psets_per_element": 2, "material_assocs": 4},
+    "shared_mapped": {"shared_styles": True, "mapped_sources": 40, "psets_per_element": 2, "material_assocs": 4},
+}
+# make_model() arguments that can be swept from the command line, overriding the scenario's value
+SWEEPS = ("psets_per_element", "material_assocs")
+
+def _proc_status_mb(field):
+    # Linux: VmHWM is the peak RSS, and unlike ru_maxrss it can be reset
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss():
+    """Restart the peak RSS count from the current RSS; False where the platform cannot."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / 1024**2, 1)
+    except ImportError:
+        return None
+
+def _params(scenario, overrides=None):
+    return {**SCENARIOS[scenario], **(overrides or {})}
+
+def _run_case(case, n, scenario, overrides, repeat, queue):
+    # runs in a child process: build the model, then time `case` `repeat` times
+    from bench.synthetic import make_model, species_rules
+    from core.io_ifc import open_ifc_from_bytes, save_ifc_to_bytes
+    from core.psets import build_pset_index, index_model
+    from core.colorize import recolor_with_rules
+    from core.step import scan_index
+
+    kwargs = dict(_params(scenario, overrides), n_elements=n)
+    model = make_model(**kwargs)
+    rules = species_rules()
+    data = save_ifc_to_bytes(model) if case in ("open_ifc_from_bytes", "open_index_model", "scan_index") else None
+    # without a reset the peak also holds whatever building the model took
+    gc.collect()
+    _reset_peak_rss()
+    base_rss = _peak_rss_mb()
+
+    def once():
+        if case == "open_ifc_from_bytes":
+            open_ifc_from_bytes(data)
+        elif case == "save_ifc_to_bytes":
+            save_ifc_to_bytes(model)
+        elif case == "build_pset_index":
+            build_pset_index(model)
+        elif case == "index_model":
+            index_model(model)
+        elif case == "open_index_model":
+            index_model(open_ifc_from_bytes(data))
+        elif case == "scan_index":
+            scan_index(data)
+        elif case == "recolor_dry_run":
+            recolor_with_rules(model, rules, dry_run=True)
+        elif case == "recolor_apply":
+            recolor_with_rules(model, rules)
+
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        once()
+        times.append(time.perf_counter() - t)
+    peak = _peak_rss_mb()
+    queue.put({
+        "case": case, "n": n, "scenario": scenario,
+        **{k: kwargs[k] for k in SWEEPS},
+        "seconds": round(statistics.median(times), 4),
+        "seconds_min": round(min(times), 4),
+        "peak_rss_mb": peak,
+        "model_rss_mb": base_rss,
+        "case_rss_mb": round(peak - base_rss, 1) if peak is not None and base_rss is not None else None,
+    })
+
+def run_case(case, n, scenario, repeat=3, overrides=None):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(case, n, scenario, overrides, repeat, queue))
+    proc.start()
+    try:
+        res = queue.get(timeout=3600)
+    except Exception:
+        params = _params(scenario, overrides)
+        res = {"case": case, "n": n, "scenario": scenario, **{k: params[k] for k in SWEEPS},
+               "error": f"exit code {proc.exitcode}"}
+    proc.join()
+    return res
+
+def _key(r):
+    # results from before the sweeps were recorded ran with the scenario's values
+    params = SCENARIOS.get(r["scenario"], {})
+    return (r["case"], r["scenario"], r["n"]) + tuple(r.get(k, params.get(k)) for k in SWEEPS)
+
+def compare(results, baseline, threshold):
+    """Return [(result, baseline_result, ratio)] for cases slower than baseline * (1 + threshold)."""
+    base = {_key(r): r for r in baseline.get("results", []) if "seconds" in r}
+    slow = []
+    for r in results:
+        b = base.get(_key(r))
+        if not b or "seconds" not in r or b["seconds"] <= 0:
+            continue
+        ratio = r["seconds"] / b["seconds"]
+        if ratio > 1 + threshold:
+            slow.append((r, b, ratio))
+    return slow
+
+def _meta():
+    meta = {"python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    try:
+        import ifcopenshell
+        meta["ifcopenshell"] = ifcopenshell.version
+    except Exception:
+        pass
+    return meta
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    ap.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    ap.add_argument("--psets-per-element", type=int, nargs="+", help="pset fan-out values to sweep (default: the scenario's)")
+    ap.add_argument("--material-assocs", type=int, nargs="+", help="material association counts to sweep (default: the scenario's)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default="bench/results/latest.json")
+    ap.add_argument("--baseline", help="results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown (default 0.25)")
+    ap.add_argument("--save-baseline", help="also write these results as the new baseline")
+    args = ap.parse_args(argv)
+
+    sweeps = [[(k, v) for v in getattr(args, k) or ()] or [()] for k in SWEEPS]
+    results = []
+    for scenario in args.scenarios:
+        for combo in itertools.product(*sweeps):
+            overrides = dict(kv for kv in combo if kv)
+            label = scenario + "".join(f" {k}={v}" for k, v in overrides.items())
+            for n in args.sizes:
+                for case in args.cases:
+                    res = run_case(case, n, scenario, args.repeat, overrides)
+                    results.append(res)
+                    if "error" in res:
+                        print(f"{label:14} {case:20} n={n:<7} ERROR {res['error']}", file=sys.stderr)
+                    else:
+                        print(f"{label:14} {case:20} n={n:<7} {res['seconds']:9.4f}s  "
+                              f"peak {res['peak_rss_mb']} MB (+{res['case_rss_mb']} MB)", file=sys.stderr)
+
+    doc = {"meta": _meta(), "results": results}
+    for path in filter(None, (args.out, args.save_baseline)):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(doc, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slow = compare(results, json.load(f), args.threshold)
+        for r, b, ratio in slow:
+            sweep = "".join(f" {k}={r[k]}" for k in SWEEPS if k in r)
+            print(f"REGRESSION {r['scenario']}{sweep} {r['case']} n={r['n']}: "
+                  f"{b['seconds']:.4f}s -> {r['seconds']:.4f}s (x{ratio:.2f})", file=sys.stderr)
+        return 1 if slow else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
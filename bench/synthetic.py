@@ -0,0 +1,181 @@
+# bench/synthetic.py
+"""Synthetic IFC models for benchmarks, generated locally with ifcopenshell."""
+import random
+
+import ifcopenshell
+import ifcopenshell.guid
+
+SPECIES = ["Rauhblattaster", "Sonnenhut", "Goldmelisse", "Purpur Sonnenhut",
+           "Blaue Flachslilie", "Katzenminze", "Frauenmantel", "Storchschnabel"]
+
+def make_model(n_elements=1000, psets_per_element=1, props_per_pset=4, shared_psets=1,
+               shared_styles=True, mapped_sources=0, material_assocs=0, n_species=len(SPECIES),
+               schema="IFC4"):
+    """
+    Build a landscape-like model of IfcGeographicElement "trees".
+
+    n_elements        products
+    psets_per_element own IfcPropertySet per element (the first is `lilasp` with the species)
+    props_per_pset    IfcPropertySingleValue per own pset
+    shared_psets      psets attached to all elements through one IfcRelDefinesByProperties
+    shared_styles     one IfcSurfaceStyle for all geometry, else one per element / map
+    mapped_sources    >0: elements are IfcMappedItem instances of that many representation maps
+    material_assocs   IfcRelAssociatesMaterial relations, each with a styled material,
+                      spread round-robin over the elements
+    """
+    f = ifcopenshell.file(schema=schema)
+    origin = f.createIfcCartesianPoint((0.0, 0.0, 0.0))
+    placement = f.createIfcAxis2Placement3D(origin)
+    ctx = f.createIfcGeometricRepresentationContext(
+        None, "Model", 3, 1e-5, placement, None)
+
+    def surface_style(rgb=(1.0, 1.0, 1.0)):
+        col = f.createIfcColourRgb(None, *rgb)
+        rend = f.createIfcSurfaceStyleRendering(col, 0.0, None, None, None, None, None, None, "NOTDEFINED")
+        return f.createIfcSurfaceStyle("style", "BOTH", [rend])
+
+    shared = surface_style() if shared_styles else None
+
+    def styled_geometry():
+        geom = f.createIfcSphere(placement, 1.0)
+        f.createIfcStyledItem(geom, [shared or surface_style()], None)
+        return geom
+
+    maps = []
+    for _ in range(mapped_sources):
+        rep = f.createIfcShapeRepresentation(ctx, "Body", "CSG", [styled_geometry()])
+        maps.append(f.createIfcRepresentationMap(placement, rep))
+    op = f.createIfcCartesianTransformationOperator3D(None, None, origin, None, None) if maps else None
+
+    species = SPECIES[:max(1, n_species)]
+    elements = []
+    for i in range(n_elements):
+        if maps:
+            item = f.createIfcMappedItem(maps[i % len(maps)], op)
+            rep = f.createIfcShapeRepresentation(ctx, "Body", "MappedRepresentation", [item])
+        else:
+            rep = f.createIfcShapeRepresentation(ctx, "Body", "CSG", [styled_geometry()])
+        shape = f.createIfcProductDefinitionShape(None, None, [rep])
+        e = f.createIfcGeographicElement(ifcopenshell.guid.new(), None, f"Tree {i}", None, None,
+                                         None, shape, None, None)
+        for p in range(psets_per_element):
+            props = []
+            if p == 0:
+                props.append(f.createIfcPropertySingleValue(
+                    "dt. Bezeichnung", None, f.createIfcLabel(species[i % len(species)]), None))
+            for k in range(props_per_pset - len(props)):
+                props.append(f.createIfcPropertySingleValue(
+                    f"Prop{k}", None, f.createIfcLabel(f"v{(i + k) % 97}"), None))
+            pset = f.createIfcPropertySet(ifcopenshell.guid.new(), None, "lilasp" if p == 0 else f"Pset_{p}",
+                                          None, props)
+            f.createIfcRelDefinesByProperties(ifcopenshell.guid.new(), None, None, None, [e], pset)
+        elements.append(e)
+
+    for s in range(shared_psets):
+        pset = f.createIfcPropertySet(ifcopenshell.guid.new(), None, f"Shared_{s}", None,
+                                      [f.createIfcPropertySingleValue("Zone", None, f.createIfcLabel("A"), None)])
+        f.createIfcRelDefinesByProperties(ifcopenshell.guid.new(), None, None, None, elements, pset)
+
+    for m in range(material_assocs):
+        mat = f.createIfcMaterial(f"Material {m}", None, None)
+        si = f.createIfcStyledItem(None, [surface_style((0.5, 0.5, 0.5))], None)
+        srep = f.createIfcStyledRepresentation(ctx, "Style", "Material", [si])
+        f.createIfcMaterialDefinitionRepresentation(None, None, [srep], mat)
+        related = elements[m::material_assocs]
+        if related:
+            f.createIfcRelAssociatesMaterial(ifcopenshell.guid.new(), None, None, None, related, mat)
+    return f
+
+def species_rules(n_species=len(SPECIES), extra_contains=1):
+    """A species catalogue: one `equals` rule per species plus some `contains` rules."""
+    rules = []
+    for i, name in enumerate(SPECIES[:n_species]):
+        rules.append({
+            "entity": "IfcGeographicElement",
+            "conditions": [{"pset": "lilasp", "key": "dt. Bezeichnung", "op": "equals",
+                            "value": name, "case": "insensitive"}],
+            "color": {"hex": "#%02x%02x%02x" % (40 + 20 * i, 90, 60)},
+        })
+    for i in range(extra_contains):
+        rules.insert(0, {
+            "entity": "*",
+            "conditions": [{"pset": "lila", "key": "dt. Bezeichnung", "op": "contains",
+                            "value": f"nomatch{i}", "case": "insensitive"}],
+            "color": {"hex": "#000000"},
+        })
+    return rules
+
+VARIED_TYPES = ("IfcWall", "IfcSlab", "IfcBuildingElementProxy", "IfcColumn", "IfcSpace", "IfcSite")
+
+def make_varied_model(n_elements=300, n_psets=None, schema="IFC4", seed=0):
+    """
+    Build a model with what trips up value handling: several product types
+    (IfcWallStandardCase where the schema has it), psets shared by random
+    element groups, typed values (labels with quotes, STEP syntax, non-ASCII
+    and astral characters, reals, integers, booleans, logicals, measures),
+    missing values, enumerated properties and an empty IfcElementQuantity.
+    `n_psets` defaults to one per 5 elements (at least 40).
+    """
+    rnd = random.Random(seed)
+    f = ifcopenshell.file(schema=schema)
+    types = list(VARIED_TYPES)
+    if schema != "IFC2X3":
+        types.append("IfcGeographicElement")
+    if schema in ("IFC2X3", "IFC4"):
+        types.append("IfcWallStandardCase")
+    els = [f.create_entity(rnd.choice(types), GlobalId=ifcopenshell.guid.new(), Name=f"e{i}")
+           for i in range(n_elements)]
+
+    def value():
+        k = rnd.randrange(9)
+        if k == 0:
+            return f.create_entity("IfcLabel", rnd.choice(["a", "ä ö;ü", "it's", "#3=X(", "", "日本", "x\\y", "😀"]))
+        if k == 1:
+            return f.create_entity("IfcReal", rnd.choice([0.0, 1.5, -2.25, 1e-7, 3e21, 10.0]))
+        if k == 2:
+            return f.create_entity("IfcInteger", rnd.choice([0, 1, -5, 123456]))
+        if k == 3:
+            return f.create_entity("IfcBoolean", rnd.choice([True, False]))
+        if k == 4:
+            return f.create_entity("IfcLogical", rnd.choice([True, False, "UNKNOWN"]))
+        if k == 5:
+            return None
+        if k == 6:
+            return f.create_entity("IfcIdentifier", "id" + str(rnd.randrange(5)))
+        if k == 7:
+            return f.create_entity("IfcLengthMeasure", rnd.random() * 100)
+        return f.create_entity("IfcText", "line '' /* c; */ end")
+
+    for _ in range(n_psets or max(40, n_elements // 5)):
+        props = []
+        for _ in range(rnd.randrange(1, 6)):
+            if rnd.random() < 0.1:
+                props.append(f.create_entity("IfcPropertyEnumeratedValue", Name="enum",
+                                             EnumerationValues=[f.create_entity("IfcLabel", "x")]))
+            else:
+                props.append(f.create_entity("IfcPropertySingleValue", NominalValue=value(),
+                                             Name=rnd.choice(["K1", "K2", "Höhe", "K;4", "K5"])))
+        pset = f.create_entity("IfcPropertySet", GlobalId=ifcopenshell.guid.new(),
+                               Name=rnd.choice(["P1", "P2", "Pset_Ü", "Common"]), HasProperties=props)
+        f.create_entity("IfcRelDefinesByProperties", GlobalId=ifcopenshell.guid.new(),
+                        RelatedObjects=rnd.sample(els, rnd.randrange(1, min(20, n_elements) + 1)),
+                        RelatingPropertyDefinition=pset)
+    q = f.create_entity("IfcElementQuantity", GlobalId=ifcopenshell.guid.new(), Name="Q", Quantities=[])
+    f.create_entity("IfcRelDefinesByProperties", GlobalId=ifcopenshell.guid.new(), RelatedObjects=els[:5],
+                    RelatingPropertyDefinition=q)
+    return f
+
+def varied_rules():
+    """Rules over make_varied_model() values: every op, both cases, entity filters and a wildcard."""
+    def rule(entity, pset, key, op, value, case="insensitive", hex_="#336699"):
+        return {"entity": entity, "conditions": [{"pset": pset, "key": key, "op": op, "value": value,
+                                                  "case": case}], "color": {"hex": hex_}}
+    return [
+        rule("*", "p", "K1", "contains", "ö", hex_="#aa0000"),
+        rule("IfcWall", "", "K1", "equals", "IT'S", hex_="#00aa00"),
+        rule("IfcWall", "Common", "Höhe", "regex", r"^\d+\.\d", "sensitive", hex_="#0000aa"),
+        rule("IfcBuildingElementProxy", "pset_ü", "K;4", "equals", "id1", hex_="#aaaa00"),
+        rule("IfcSpace", "", "K5", "contains", "''", hex_="#00aaaa"),
+        rule("*", "P", "K1", "regex", "^(True|1)$", "sensitive", hex_="#aa00aa"),
+        rule("IfcProduct", "", "K2", "equals", "😀"),
+    ]
@@ -1,27 +1,165 @@
 # core/colorize.py
 EPS = 1e-6
-from utils.colors import parse_color
-from utils.ifc_helpers import surface_styles_simple, has_colour_rgb, material_styles_for_product
-from core.rules import matches
-
-def get_or_make_rgb(model, rgb_tuple, name=None):
-    r, g, b = rgb_tuple
-    for c in model.by_type("IfcColourRgb") or []:
-        if abs(c.Red-r) < EPS and abs(c.Green-g) < EPS and abs(c.Blue-b) < EPS:
+import math
+from utils.ifc_helpers import has_colour_rgb, StyleGraph
+from utils.palette import Palette, to_space
+from core.rules import compile_rules
+from core.psets import PropertyTables, PropertyIndex
+from core.parallel import parallel_match, PARALLEL_MIN_ELEMENTS
+from utils.profiling import NULL_PROFILER, Profiler
+
+def _clone_entity(model, entity, **changes):
+    """Create a copy of `entity` (shallow: references are shared), overriding `changes`."""
+    info = entity.get_info(include_identifier=False, recursive=False)
+    info.pop("type", None)
+    info.update(changes)
+    return model.create_entity(entity.is_a(), **info)
+
+class ColourRegistry:
+    """
+    IfcColourRgb lookup for one model, keyed by RGB quantized to EPS; `snap` reuses the nearest
+    colour within that distance ("rgb": largest channel difference, "delta_e": CIE76 ΔE).
+    """
+    def __init__(self, model, eps=EPS, snap=None, metric="rgb"):
+        self.model = model
+        self.eps = eps
+        self.snap = snap or None
+        self.metric = metric if self.snap else "rgb"
+        self.tol = self.snap or eps
+        self._buckets = {}
+        self._coords = {}
+        self._resolved = {}
+        self._stats = [0, 0]
+        # ids of the colours this registry added to the model, in order
+        self.created = []
+        for c in model.by_type("IfcColourRgb") or []:
+            self._register(c)
+
+    def _space(self, rgb_tuple):
+        if self.metric == "rgb":
+            return tuple(rgb_tuple)
+        return tuple(float(v) for v in to_space(rgb_tuple, self.metric))
+
+    def _key(self, coords):
+        return tuple(int(v // self.tol) for v in coords)
+
+    def _register(self, c):
+        coords = self._space((c.Red, c.Green, c.Blue))
+        self._coords[c.id()] = coords
+        self._buckets.setdefault(self._key(coords), []).append(c)
+
+    def _distance(self, a, b):
+        if self.metric == "rgb":
+            return max(abs(x - y) for x, y in zip(a, b))
+        return math.dist(a, b)
+
+    def find(self, rgb_tuple):
+        """
+        Return the existing colour within EPS on every channel (lowest id wins),
+        or with `snap` the nearest one within it; else None.
+        """
+        coords = self._space(rgb_tuple)
+        kr, kg, kb = self._key(coords)
+        best = None
+        best_d = None
+        # values closer than the tolerance can only sit in the same or an adjacent cell
+        for dr in (-1, 0, 1):
+            for dg in (-1, 0, 1):
+                for db in (-1, 0, 1):
+                    for c in self._buckets.get((kr + dr, kg + dg, kb + db), ()):
+                        d = self._distance(self._coords[c.id()], coords)
+                        if d >= self.tol:
+                            continue
+                        if self.snap:
+                            if best is None or (d, c.id()) < (best_d, best.id()):
+                                best, best_d = c, d
+                        elif best is None or c.id() < best.id():
+                            best = c
+        return best
+
+    def prime(self, palette):
+        """Resolve every palette colour against the existing ones in one vectorized pass."""
+        todo = [rgb for rgb in palette.colours if rgb not in self._resolved]
+        if not todo:
+            return
+        todo = Palette(todo)
+        known = sorted(self._iter_colours(), key=lambda c: c.id())
+        existing = [(c.Red, c.Green, c.Blue) for c in known]
+        hits = todo.match(existing, self.tol, metric=self.metric,
+                          ids=[c.id() for c in known], nearest=bool(self.snap))
+        for rgb, i in zip(todo.colours, hits):
+            if i >= 0:
+                self._resolved[rgb] = known[i]
+
+    def forget(self, colour):
+        """Unregister a colour (before it is removed from the model)."""
+        cid = colour.id()
+        coords = self._coords.pop(cid, None)
+        if coords is not None:
+            bucket = self._buckets.get(self._key(coords), [])
+            bucket[:] = [c for c in bucket if c.id() != cid]
+        for rgb in [rgb for rgb, c in self._resolved.items() if c.id() == cid]:
+            del self._resolved[rgb]
+        if cid in self.created:
+            self.created.remove(cid)
+
+    def cache_info(self):
+        return {"colours": {"hits": self._stats[0], "misses": self._stats[1]}}
+
+    def _iter_colours(self):
+        for bucket in self._buckets.values():
+            yield from bucket
+
+    def get_or_make(self, rgb_tuple, name=None):
+        key = tuple(rgb_tuple)
+        c = self._resolved.get(key)
+        if c is not None:
+            self._stats[0] += 1
             return c
-    return model.create_entity("IfcColourRgb", Name=name, Red=r, Green=g, Blue=b)
+        self._stats[1] += 1
+        c = self.find(rgb_tuple)
+        if c is None:
+            r, g, b = rgb_tuple
+            c = self.model.create_entity("IfcColourRgb", Name=name, Red=r, Green=g, Blue=b)
+            self._register(c)
+            self.created.append(c.id())
+        self._resolved[key] = c
+        return c
+
+def get_or_make_rgb(model, rgb_tuple, name=None, colours=None):
+    if colours is None:
+        colours = ColourRegistry(model)
+    return colours.get_or_make(rgb_tuple, name=name)
+
+def _preselect_types(plan):
+    """Entity types a PropertyIndex must cover to preselect targets for `plan`; None if it cannot."""
+    if not all(r.conditions for r in plan.rules):
+        return None
+    return ("IfcProduct",) if plan.wildcard else plan.entities
+
+def _gather_targets(model, plan, index=None):
+    """
+    Elements the rules can apply to, in model order. With a PropertyIndex,
+    only those satisfying all conditions of some rule (the rest cannot match).
+    """
+    cands = None
+    types = _preselect_types(plan) if index is not None else None
+    if types is not None:
+        index.ensure(types)
+        cands = index.candidates(plan)
+
+    def elements(ent):
+        if cands is None:
+            return model.by_type(ent) or []
+        return [model.by_id(eid) for eid in index.scope(ent) if eid in cands]
 
-def _gather_targets(model, rules):
     # if any rule is "*" → scan broadly (IfcProduct)
-    if any((r.get("entity") in (None, "", "*", "All", "Any")) for r in rules):
-        return list(model.by_type("IfcProduct") or [])
+    if plan.wildcard:
+        return list(elements("IfcProduct"))
     # else union of entities from rules
     seen = set(); targets = []
-    for r in rules:
-        ent = r.get("entity")
-        if not ent:
-            continue
-        for e in model.by_type(ent) or []:
+    for ent in plan.entities:
+        for e in elements(ent):
             gid = getattr(e, "GlobalId", None)
             if gid and gid in seen:
                 continue
@@ -30,46 +168,433 @@ def _gather_targets(model, rules):
                 seen.add(gid)
     return targets
 
-def recolor_with_rules(model, rules, dry_run=False):
-    changed = 0
-    touched = set()
-    targets = _gather_targets(model, rules)
-
-    for prod in targets:
-        # pick the first matching rule's color
-        apply_rgb = None
-        for rule in rules:
-            if matches(prod, rule):
-                apply_rgb = parse_color(rule["color"])
-                break
-        if not apply_rgb:
-            continue
-
-        new_rgb = get_or_make_rgb(model, apply_rgb, name="LL-Recolor")
-        any_hit = False
-
-        # A) direct + mapped styles (instance & MappingSource)
-        for sty in surface_styles_simple(prod):
-            if not has_colour_rgb(sty):
+class RecolorSession:
+    """
+    Recolour runs against one model that reuse lookup tables and re-evaluate only what
+    edited rules can change; every change is journaled so revert() can undo it.
+    """
+    def __init__(self, model, colours=None, materials=None, props=None, styles=None, split_shared=False,
+                 snap=None, snap_metric="rgb", workers=None, preselect=True):
+        self.model = model
+        self.workers = workers
+        self.split_shared = split_shared
+        self.snap = snap
+        self.snap_metric = snap_metric
+        self.colours = colours
+        self.styles = styles if styles is not None else StyleGraph(model, materials=materials)
+        self.props = props if props is not None else PropertyTables()
+        self.index = PropertyIndex(model, self.props) if preselect else None
+        self._styles = {}
+        self._style_stats = [0, 0]
+        # last evaluation: rule keys in order, target ids, element id -> rule key
+        self._keys = None
+        self._targets = set()
+        self._winners = {}
+        # what this session has written: element id -> rgb, style id -> rgb / original colour
+        self._applied = {}
+        self._style_rgb = {}
+        self._original = {}
+        # ids of every entity this session created (colours, style clones), in order
+        self._created = []
+        # split mode: clone pool, (styled item id, style id) -> current container, split style ids
+        self._mode = None
+        self._pool = {}
+        self._links = {}
+        self._split_groups = set()
+
+    def element_styles(self, prod):
+        """Colourable styles of a product (direct, mapped and material), memoized."""
+        hit = self._styles.get(prod.id())
+        self._style_stats[hit is None] += 1
+        if hit is None:
+            hit = self._styles[prod.id()] = tuple(sty for sty in self.styles.styles(prod) if has_colour_rgb(sty))
+        return hit
+
+    def cache_info(self):
+        """Hit/miss counts of every lookup cache this session uses, by name."""
+        info = {"element_styles": {"hits": self._style_stats[0], "misses": self._style_stats[1]}}
+        for part in (self.styles, self.props, self.colours):
+            if part is not None:
+                info.update(part.cache_info())
+        return info
+
+    def match_all(self, plan, targets):
+        """{element id: first matching rule} for `targets`, in worker processes if worthwhile."""
+        if self.workers and self.workers > 1 and len(targets) >= PARALLEL_MIN_ELEMENTS:
+            return parallel_match(plan, targets, self.props, self.workers)
+        winners = {}
+        for prod in targets:
+            rule = plan.first_match(prod, self.props)
+            if rule is not None:
+                winners[prod.id()] = rule
+        return winners
+
+    def evaluate(self, plan, targets):
+        """Return {element id: CompiledRule} for `targets`, reusing the last evaluation."""
+        props = self.props
+        rules_by_key = dict(zip(plan.keys, plan.rules))
+        if self._keys is None:
+            winners = self.match_all(plan, targets)
+            self.reevaluated = len(targets)
+        else:
+            old_pos = {k: i for i, k in enumerate(self._keys)}
+            new_pos = {k: i for i, k in enumerate(plan.keys)}
+            added = tuple(i for i, k in enumerate(plan.keys) if k not in old_pos)
+            candidates = {}
+
+            def to_check(key):
+                # rules now ahead of `key` that did not lose to it last time
+                hit = candidates.get(key)
+                if hit is None:
+                    if key is None:
+                        hit = added
+                    else:
+                        wo = old_pos[key]
+                        hit = tuple(i for i in range(new_pos[key])
+                                    if plan.keys[i] not in old_pos or old_pos[plan.keys[i]] > wo)
+                    candidates[key] = hit
+                return hit
+
+            winners = {}
+            full = []
+            n = 0
+            for prod in targets:
+                eid = prod.id()
+                prev = self._winners.get(eid) if eid in self._targets else False
+                if prev is False or (prev is not None and prev not in new_pos):
+                    # new target, or its rule was edited/removed
+                    full.append(prod)
+                    continue
+                check = to_check(prev)
+                rule = rules_by_key.get(prev)
+                if check:
+                    n += 1
+                    hit = plan.first_of(props.table(prod), plan.types_for(prod), check)
+                    if hit is not None:
+                        rule = hit
+                if rule is not None:
+                    winners[eid] = rule
+            winners.update(self.match_all(plan, full))
+            self.reevaluated = n + len(full)
+        self._keys = plan.keys
+        self._targets = {prod.id() for prod in targets}
+        self._winners = {eid: plan.keys[rule.index] for eid, rule in winners.items()}
+        return winners
+
+    def iter_dry_run(self, rules, batch_size=1000, samples=5):
+        """
+        Dry run as a generator of cumulative progress dicts (phase "indexing", then "matching");
+        the last has finished=True and run(dry_run=True)'s counts. Stop iterating to cancel.
+        """
+        plan = compile_rules(rules)
+        prog = {"phase": "indexing", "done": 0, "total": 0, "matched": 0, "changed_styles": 0,
+                "touched_elements": 0, "rules": {}, "finished": False}
+        types = _preselect_types(plan) if self.index is not None else None
+        if types is not None:
+            for done, total in self.index.iter_ensure(types, batch_size):
+                prog.update(done=done, total=total)
+                yield prog
+        targets = _gather_targets(self.model, plan, self.index)
+        prog.update(phase="matching", done=0, total=len(targets))
+        winners = {}
+        for start in range(0, len(targets), batch_size):
+            batch = targets[start:start + batch_size]
+            found = self.match_all(plan, batch)
+            for prod in batch:
+                rule = found.get(prod.id())
+                if rule is None:
+                    continue
+                styles = self.element_styles(prod)
+                gid = getattr(prod, "GlobalId", None)
+                prog["changed_styles"] += len(styles)
+                if styles and gid:
+                    prog["touched_elements"] += 1
+                hit = prog["rules"].setdefault(rule.index, {"hits": 0, "samples": []})
+                hit["hits"] += 1
+                if gid and len(hit["samples"]) < samples:
+                    hit["samples"].append(gid)
+            winners.update(found)
+            prog["done"] += len(batch)
+            prog["matched"] = len(winners)
+            yield prog
+        # a complete pass is as good as evaluate(): keep it for the next run
+        self._keys = plan.keys
+        self._targets = {prod.id() for prod in targets}
+        self._winners = {eid: plan.keys[rule.index] for eid, rule in winners.items()}
+        self.reevaluated = len(targets)
+        prog["finished"] = True
+        yield prog
+
+    # ---------- journal ----------
+    def _colour(self, rgb):
+        n = len(self.colours.created)
+        colour = self.colours.get_or_make(rgb, name="LL-Recolor")
+        if len(self.colours.created) > n:
+            self._created.append(colour.id())
+        return colour
+
+    def _clone(self, entity, **changes):
+        clone = _clone_entity(self.model, entity, **changes)
+        self._created.append(clone.id())
+        return clone
+
+    def _remove_created(self, unused_only):
+        # newest first: clones go before the styles/colours they reference
+        kept = []
+        removed = set()
+        for eid in reversed(self._created):
+            ent = self.model.by_id(eid)
+            if unused_only and self.model.get_total_inverses(ent):
+                kept.append(eid)
+                continue
+            if ent.is_a("IfcColourRgb") and self.colours is not None:
+                self.colours.forget(ent)
+            self.model.remove(ent)
+            removed.add(eid)
+        self._created = kept[::-1]
+        if removed:
+            self._pool = {k: v for k, v in self._pool.items() if v.id() not in removed}
+        return len(removed)
+
+    @property
+    def modified(self):
+        """True once an apply has touched the model and revert() has not undone it."""
+        return bool(self._original or self._links or self._created)
+
+    def journal(self):
+        """(changed, added) entity ids for core.io_ifc.save_ifc_patched."""
+        changed = [rid for rid, col in self._original.items()
+                   if self.model.by_id(rid).SurfaceColour != col]
+        changed += sorted({si_id for si_id, _ in self._links})
+        return changed, list(self._created)
+
+    def prune(self):
+        """Delete entities this session created that nothing references any more; returns how many."""
+        return self._remove_created(unused_only=True)
+
+    def revert(self):
+        """Undo every change and delete every created entity; matching state is kept."""
+        self._reset()
+        self._remove_created(unused_only=False)
+        self._pool = {}
+        self._original = {}
+        self._mode = None
+
+    # ---------- split mode ----------
+    def _set_rendering(self, rend, colour):
+        """Recolour one rendering; colour None restores the file's colour."""
+        self._original.setdefault(rend.id(), rend.SurfaceColour)
+        rend.SurfaceColour = colour if colour is not None else self._original[rend.id()]
+
+    def _colour_style(self, style, rgb):
+        colour = self._colour(rgb) if rgb is not None else None
+        for rend in self.styles.renderings_of(style):
+            if has_colour_rgb(rend):
+                self._set_rendering(rend, colour)
+
+    def _style_clone(self, style, rgb):
+        key = (style.id(), rgb)
+        hit = self._pool.get(key)
+        if hit is None:
+            colour = self._colour(rgb)
+            subs = []
+            for sub in style.Styles or []:
+                if sub and (sub.is_a("IfcSurfaceStyleRendering") or sub.is_a("IfcSurfaceStyleShading")) \
+                        and has_colour_rgb(sub):
+                    sub = self._clone(sub, SurfaceColour=colour)
+                subs.append(sub)
+            hit = self._pool[key] = self._clone(style, Styles=subs)
+            self._cloned += 1
+        return hit
+
+    def _container_for(self, origin, style, target):
+        # the entry si.Styles needs so that it resolves to `target` instead of `style`
+        if target.id() == style.id():
+            return origin
+        if origin.id() == style.id():
+            return target
+        key = (origin.id(), target.id())
+        hit = self._pool.get(key)
+        if hit is None:
+            styles = [target if s.id() == style.id() else s for s in origin.Styles or []]
+            hit = self._pool[key] = self._clone(origin, Styles=styles)
+        return hit
+
+    def _link(self, si, style, target):
+        origin = self.styles.container(si, style)
+        current = self._links.get((si.id(), style.id()), origin)
+        want = self._container_for(origin, style, target)
+        if current.id() == want.id():
+            return
+        si.Styles = [want if c.id() == current.id() else c for c in si.Styles or []]
+        if want.id() == origin.id():
+            self._links.pop((si.id(), style.id()), None)
+        else:
+            self._links[(si.id(), style.id())] = want
+
+    def _reset(self):
+        """Undo everything this session applied (links and colours); clones stay pooled."""
+        for (si_id, sty_id) in list(self._links):
+            sty = self.model.by_id(sty_id)
+            self._link(self.model.by_id(si_id), sty, sty)
+        for rid, col in self._original.items():
+            self.model.by_id(rid).SurfaceColour = col
+        self._applied = {}
+        self._style_rgb = {}
+        self._split_groups = set()
+
+    def _apply_split(self, targets, winners):
+        g = self.styles
+        desired = {}
+        items = {}
+        conflicts = set()
+        for prod in targets:
+            rule = winners.get(prod.id())
+            if rule is None:
                 continue
-            if not dry_run:
-                sty.SurfaceColour = new_rgb
-            changed += 1
-            any_hit = True
-
-        # B) material styled representations (instance + type)
-        for sty in material_styles_for_product(model, prod, include_type=True):
-            if not has_colour_rgb(sty):
+            for si in g.styled_items(prod):
+                prev = desired.get(si.id())
+                if prev is not None and prev != rule.rgb:
+                    conflicts.add(si.id())
+                desired[si.id()] = rule.rgb
+                items[si.id()] = si
+        groups = {}
+        for si in items.values():
+            for sty in g.surface_styles_of(si):
+                groups[sty.id()] = sty
+        # styles touched last time but not now go back to how the file had them
+        for sid in self._split_groups - groups.keys():
+            sty = self.model.by_id(sid)
+            self._colour_style(sty, None)
+            for si in g.users(sty):
+                self._link(si, sty, sty)
+        self._cloned = 0
+        split = 0
+        for sty in groups.values():
+            users = g.users(sty)
+            wants = {desired.get(si.id()) for si in users}
+            if len(wants) == 1 and None not in wants:
+                self._colour_style(sty, next(iter(wants)))
+                for si in users:
+                    self._link(si, sty, sty)
                 continue
-            if not dry_run:
-                sty.SurfaceColour = new_rgb
-            changed += 1
-            any_hit = True
+            split += 1
+            self._colour_style(sty, None)
+            for si in users:
+                rgb = desired.get(si.id())
+                self._link(si, sty, sty if rgb is None else self._style_clone(sty, rgb))
+        self._split_groups = set(groups)
+        return {"split_styles": split, "cloned_styles": self._cloned, "conflicting_items": len(conflicts)}
 
-        if any_hit:
-            gid = getattr(prod, "GlobalId", None)
-            if gid:
-                touched.add(gid)
+    def run(self, rules, dry_run=False, split_shared=None, profile=None, revert_first=False):
+        """Same contract as recolor_with_rules; `revert_first` applies onto the model as parsed."""
+        if revert_first and not dry_run:
+            self.revert()
+        if not profile:
+            return self._run(rules, dry_run, split_shared, NULL_PROFILER)
+        prof = profile if isinstance(profile, Profiler) else Profiler()
+        before = self.cache_info()
+        self.styles.profiler = self.props.profiler = prof
+        prof.start()
+        try:
+            with prof.phase("compile"):
+                plan = compile_rules(rules)
+            before.update(plan.cache_info())
+            plan.profiler = prof
+            try:
+                result = self._run(plan, dry_run, split_shared, prof)
+            finally:
+                plan.profiler = None
+        finally:
+            prof.stop()
+            self.styles.profiler = self.props.profiler = NULL_PROFILER
+        after = self.cache_info()
+        after.update(plan.cache_info())
+        for name, info in after.items():
+            old = before.get(name, {"hits": 0, "misses": 0})
+            prof.cache(name, {"hits": info["hits"] - old["hits"], "misses": info["misses"] - old["misses"]})
+        stats = result if dry_run else result[1]
+        stats["profile"] = prof.as_dict()
+        return result
+
+    def _run(self, rules, dry_run, split_shared, prof):
+        plan = compile_rules(rules)
+        with prof.phase("gather_targets"):
+            targets = _gather_targets(self.model, plan, self.index)
+        with prof.phase("match"):
+            winners = self.evaluate(plan, targets)
+        if prof.enabled:
+            for rule in winners.values():
+                prof.rule_wins(rule.index)
+            prof.count("targets", len(targets))
+            prof.count("matched_elements", len(winners))
+
+        changed = 0
+        touched = 0
+        with prof.phase("style_lookup"):
+            for prod in targets:
+                rule = winners.get(prod.id())
+                if rule is None:
+                    continue
+                styles = self.element_styles(prod)
+                changed += len(styles)
+                if styles and getattr(prod, "GlobalId", None):
+                    touched += 1
+        stats = {"changed_styles": changed, "touched_elements": touched,
+                 "reevaluated_elements": self.reevaluated}
+        if dry_run:
+            return stats
+
+        with prof.phase("colour_creation"):
+            if self.colours is None:
+                self.colours = ColourRegistry(self.model, snap=self.snap, metric=self.snap_metric)
+            # all rule colours resolved against the model's colours in one pass
+            self.colours.prime(Palette.from_plan(plan))
+        mode = "split" if (self.split_shared if split_shared is None else split_shared) else "plain"
+        with prof.phase("apply"):
+            return self._apply(targets, winners, mode, stats)
+
+    def _apply(self, targets, winners, mode, stats):
+        if self._mode is not None and self._mode != mode:
+            self._reset()
+        self._mode = mode
+        if mode == "split":
+            stats.update(self._apply_split(targets, winners))
+        else:
+            self._apply_plain(targets, winners, stats)
+        # clones/colours only earlier palettes used would otherwise pile up in the file
+        stats["removed_entities"] = self.prune()
+        return self.model, stats
+
+    def _apply_plain(self, targets, winners, stats):
+        # a shared style ends up in the colour of the last matching element
+        # using it (target order), whatever was written on earlier runs
+        desired = {}
+        for prod in targets:
+            rule = winners.get(prod.id())
+            if rule is not None:
+                for sty in self.element_styles(prod):
+                    desired[sty.id()] = (sty, rule.rgb)
+        for sid in [sid for sid in self._style_rgb if sid not in desired]:
+            # no rule any more → back to the colour the file came with
+            self.model.by_id(sid).SurfaceColour = self._original[sid]
+            del self._style_rgb[sid]
+        for sid, (sty, rgb) in desired.items():
+            if self._style_rgb.get(sid) != rgb:
+                self._original.setdefault(sid, sty.SurfaceColour)
+                sty.SurfaceColour = self._colour(rgb)
+                self._style_rgb[sid] = rgb
+        applied = {eid: rule.rgb for eid, rule in winners.items()}
+        stats["updated_elements"] = sum(applied.get(eid) != self._applied.get(eid)
+                                        for eid in applied.keys() | self._applied.keys())
+        self._applied = applied
 
-    stats = {"changed_styles": changed, "touched_elements": len(touched)}
-    return (model, stats) if not dry_run else stats
+def recolor_with_rules(model, rules, dry_run=False, colours=None, materials=None, props=None, styles=None,
+                       split_shared=False, snap=None, snap_metric="rgb", profile=None, workers=None):
+    """
+    Recolour every target by its first matching rule; bad rules raise ValueError before
+    anything is touched. Use RecolorSession to re-apply edited rules incrementally.
+    """
+    session = RecolorSession(model, colours=colours, materials=materials, props=props, styles=styles,
+                             split_shared=split_shared, snap=snap, snap_metric=snap_metric, workers=workers)
+    return session.run(rules, dry_run=dry_run, profile=profile)
@@ -1,29 +1,90 @@
 # core/io_ifc.py
-import tempfile, os, ifcopenshell
+import contextlib, mmap, tempfile, os, shutil, ifcopenshell
+from core.step import StepOffsets, iter_patched
 
-def open_ifc_from_bytes(b: bytes):
-    # Safer for various encodings & big files
+CHUNK_SIZE = 1 << 20
+
+def open_ifc(path):
+    """Open an IFC from a path (no copies beyond ifcopenshell's own parse)."""
+    return ifcopenshell.open(os.fspath(path))
+
+def _open_via_tempfile(write):
     with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
-        tmp.write(b)
+        write(tmp)
         tmp_path = tmp.name
     try:
-        model = ifcopenshell.open(tmp_path)
+        return ifcopenshell.open(tmp_path)
     finally:
         try:
             os.remove(tmp_path)
         except OSError:
             pass
-    return model
 
-def save_ifc_to_bytes(model):
+def open_ifc_from_file(fobj):
+    """
+    Open an IFC from a binary file object. Real files are opened by path;
+    other streams are spooled to disk in chunks instead of read into memory.
+    """
+    path = getattr(fobj, "name", None)
+    if isinstance(path, (str, os.PathLike)) and os.path.isfile(path):
+        return open_ifc(path)
+    return _open_via_tempfile(lambda tmp: shutil.copyfileobj(fobj, tmp, CHUNK_SIZE))
+
+def open_ifc_from_bytes(b: bytes):
+    # parsed from a temp file: from_string would need the whole upload decoded to a str first
+    return _open_via_tempfile(lambda tmp: tmp.write(b))
+
+def save_ifc(model, path):
+    """Write the model straight to `path`."""
+    model.write(os.fspath(path))
+
+@contextlib.contextmanager
+def _written(model):
+    """Path of a temp file holding the serialized model, removed afterwards."""
     with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
         tmp_path = tmp.name
     try:
         model.write(tmp_path)
-        with open(tmp_path, "rb") as f:
-            return f.read()
+        yield tmp_path
     finally:
         try:
             os.remove(tmp_path)
         except OSError:
             pass
+
+def iter_ifc_chunks(model, chunk_size=CHUNK_SIZE):
+    """Yield the serialized model as chunks of at most `chunk_size` bytes, read back from a temp file."""
+    with _written(model) as tmp_path, open(tmp_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def save_ifc_to_file(model, fobj, chunk_size=CHUNK_SIZE):
+    """Stream the serialized model into a binary file object."""
+    with _written(model) as tmp_path, open(tmp_path, "rb") as f:
+        shutil.copyfileobj(f, fobj, chunk_size)
+
+def save_ifc_to_bytes(model):
+    with _written(model) as tmp_path, open(tmp_path, "rb") as f:
+        return f.read()
+
+def save_ifc_patched(model, path, source, changed=(), added=(), offsets=None):
+    """
+    Write `model` to `path` as a copy of `source` (the path or bytes it was
+    parsed from) in which only the `changed` entity records are rewritten
+    and the `added` ones appended to the DATA section; every other byte is
+    the original's. `offsets` (core.step.StepOffsets of `source`) is built
+    if not given; returns it so callers can keep it for the next export.
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, (str, os.PathLike)):
+            f = stack.enter_context(open(source, "rb"))
+            source = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if offsets is None:
+            offsets = StepOffsets.scan(source)
+        with open(os.fspath(path), "wb") as out:
+            # writelines keeps no slice of the mmap alive past the write
+            out.writelines(iter_patched(model, source, offsets, changed, added))
+    return offsets
@@ -0,0 +1,83 @@
+# core/parallel.py
+"""
+Rule matching sharded over worker processes. The ifcopenshell model stays
+in the main process: element property tables are extracted once into plain
+tuples (PsetEntry, shared psets stored once), workers rebuild the RulePlan
+from the raw rules and return element id -> rule index. Matching runs
+RulePlan.match_table() on the same data, so results equal the serial engine.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from core.rules import RulePlan
+
+# below this many targets a pool costs more than it saves
+PARALLEL_MIN_ELEMENTS = 5000
+
+class MatchData:
+    """
+    Picklable matching input for a list of targets: unique psets, unique
+    type sets, and one (element id, pset indices, type index) row per target.
+    """
+    def __init__(self, plan, targets, props):
+        self.psets = []
+        self.types = []
+        self.rows = []
+        pset_idx = {}
+        type_idx = {}
+        for prod in targets:
+            refs = []
+            for entry in props.table(prod):
+                # PropertyTables hands out one PsetEntry object per IfcPropertySet
+                i = pset_idx.get(id(entry))
+                if i is None:
+                    i = pset_idx[id(entry)] = len(self.psets)
+                    self.psets.append(entry)
+                refs.append(i)
+            types = plan.types_for(prod)
+            t = type_idx.get(types)
+            if t is None:
+                t = type_idx[types] = len(self.types)
+                self.types.append(types)
+            self.rows.append((prod.id(), tuple(refs), t))
+
+    def shards(self, n):
+        size = max(1, -(-len(self.rows) // n))
+        return [self.rows[i:i + size] for i in range(0, len(self.rows), size)]
+
+_worker = {}
+
+def _init_worker(rules, psets, types):
+    _worker["plan"] = RulePlan(rules)
+    _worker["psets"] = psets
+    _worker["types"] = types
+
+def _match(plan, psets, types, rows):
+    out = []
+    for eid, refs, t in rows:
+        rule = plan.match_table(tuple(psets[i] for i in refs), types[t])
+        if rule is not None:
+            out.append((eid, rule.index))
+    return out
+
+def _match_rows(rows):
+    return _match(_worker["plan"], _worker["psets"], _worker["types"], rows)
+
+def parallel_match(plan, targets, props, workers=None, shards_per_worker=4):
+    """
+    Return {element id: CompiledRule}, like calling plan.first_match() on
+    every target, with the matching spread over `workers` processes
+    (default: CPU count). Falls back to matching in this process if the
+    pool breaks.
+    """
+    workers = workers or os.cpu_count() or 1
+    data = MatchData(plan, targets, props)
+    rules = [r.rule for r in plan.rules]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(rules, data.psets, data.types)) as pool:
+            pairs = [p for part in pool.map(_match_rows, data.shards(workers * shards_per_worker)) for p in part]
+    except BrokenProcessPool:
+        pairs = _match(plan, data.psets, data.types, data.rows)
+    return {eid: plan.rules[i] for eid, i in pairs}
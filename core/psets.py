@@ -1,5 +1,8 @@
 # core/psets.py
+from collections import OrderedDict, namedtuple
+from ifcopenshell import ifcopenshell_wrapper
 from utils.ifc_helpers import unwrap
+from utils.profiling import NULL_PROFILER
 
 def iter_pset_values(element, pset_name_contains, key_name):
     """Yield string values for a given (pset contains, key equals) on one element."""
@@ -14,104 +17,342 @@ def iter_pset_values(element, pset_name_contains, key_name):
             if prop.is_a("IfcPropertySingleValue") and prop.Name == key_name:
                 yield str(unwrap(getattr(prop, "NominalValue", None)) or "")
 
-def survey_psets(model, entity_types=("IfcGeographicElement",), limit_values=100, max_elements=20000):
-    """Return a flat list of {pset,key,values,count_values} for quick inspection."""
-    index = {}
-    total = 0
-    for et in entity_types:
-        try:
-            elems = model.by_type(et) or []
-        except Exception:
-            elems = []
-        for e in elems:
-            total += 1
-            if total > max_elements:
-                break
-            for rel in getattr(e, "IsDefinedBy", []) or []:
+# One extracted IfcPropertySet: props maps key -> tuple of string values,
+# folded holds the same values casefolded (for case-insensitive rules).
+PsetEntry = namedtuple("PsetEntry", "name name_lc props folded")
+
+def _make_entry(name, props):
+    props = {k: tuple(v) for k, v in props.items()}
+    folded = {k: tuple(x.casefold() for x in v) for k, v in props.items()}
+    return PsetEntry(name, name.lower(), props, folded)
+
+def _pset_entry(pdef):
+    props = {}
+    for prop in pdef.HasProperties or []:
+        if prop.is_a("IfcPropertySingleValue"):
+            val = str(unwrap(getattr(prop, "NominalValue", None)) or "")
+            props.setdefault(prop.Name, []).append(val)
+    return _make_entry(pdef.Name or "", props)
+
+class PropertyTables:
+    """
+    Per-element property tables (pset -> key -> values), extracted once per
+    element and shared by every rule/condition evaluated against it.
+    Psets referenced by many elements (one IfcRelDefinesByProperties with many
+    RelatedObjects) are extracted once. `max_elements` bounds the element
+    cache (LRU); None keeps every table.
+    """
+    def __init__(self, max_elements=None):
+        self.max_elements = max_elements
+        self.profiler = NULL_PROFILER
+        self._psets = {}
+        self._tables = OrderedDict()
+        self._stats = {"tables": [0, 0], "psets": [0, 0]}
+
+    def export_state(self):
+        """
+        Plain-data snapshot of everything extracted so far (see from_state):
+        psets as [name, [[key, [values]], ...]] with their entity ids, and
+        per element the positions of its psets in that list.
+        """
+        pos = {id(entry): i for i, entry in enumerate(self._psets.values())}
+        return {
+            "pset_ids": list(self._psets),
+            "psets": [[e.name, [[k, list(v)] for k, v in e.props.items()]] for e in self._psets.values()],
+            "element_ids": list(self._tables),
+            "element_psets": [[pos[id(entry)] for entry in table] for table in self._tables.values()],
+        }
+
+    @classmethod
+    def from_state(cls, state, max_elements=None):
+        """PropertyTables pre-filled from export_state() of the same model."""
+        props = cls(max_elements=max_elements)
+        entries = [_make_entry(name, dict(pairs)) for name, pairs in state["psets"]]
+        props._psets = dict(zip(state["pset_ids"], entries))
+        for eid, refs in zip(state["element_ids"], state["element_psets"]):
+            props._tables[eid] = tuple(entries[i] for i in refs)
+        return props
+
+    def cache_info(self):
+        return {f"property_{k}": {"hits": h, "misses": m} for k, (h, m) in self._stats.items()}
+
+    def pset(self, pdef):
+        """Return the PsetEntry for an IfcPropertySet, extracting it on first use."""
+        hit = self._psets.get(pdef.id())
+        if hit is None:
+            self._stats["psets"][1] += 1
+            hit = self._psets[pdef.id()] = _pset_entry(pdef)
+        else:
+            self._stats["psets"][0] += 1
+        return hit
+
+    def table(self, element):
+        """Return the element's psets as a tuple of PsetEntry."""
+        eid = element.id()
+        hit = self._tables.get(eid)
+        if hit is not None:
+            self._stats["tables"][0] += 1
+            self._tables.move_to_end(eid)
+            return hit
+        self._stats["tables"][1] += 1
+        out = []
+        with self.profiler.phase("property_extraction"):
+            for rel in getattr(element, "IsDefinedBy", []) or []:
                 pdef = getattr(rel, "RelatingPropertyDefinition", None)
-                if not pdef or not pdef.is_a("IfcPropertySet"):
+                if pdef and pdef.is_a("IfcPropertySet"):
+                    out.append(self.pset(pdef))
+        hit = self._tables[eid] = tuple(out)
+        if self.max_elements is not None and len(self._tables) > self.max_elements:
+            self._tables.popitem(last=False)
+        return hit
+
+class PropertyIndex:
+    """
+    Inverted property index of one model: (pset name, key) -> value ->
+    element ids, filled per entity type on demand (ensure) from a
+    PropertyTables. A rule condition is resolved against the distinct values
+    of its key instead of against every element, which gives exactly the
+    elements the condition holds for; candidates() intersects those per rule.
+    """
+    def __init__(self, model, props=None):
+        self.model = model
+        self.props = props if props is not None else PropertyTables(max_elements=0)
+        self._scopes = {}
+        self._indexed = set()
+        self._by_key = {}
+        self._memo = {}
+
+    def ensure(self, entity_types):
+        """Index every element of `entity_types` not indexed yet."""
+        for _ in self.iter_ensure(entity_types):
+            pass
+
+    def iter_ensure(self, entity_types, batch_size=1000):
+        """
+        ensure() as a generator yielding (done, total) elements after every
+        `batch_size`; stopping early keeps what was indexed, and the next
+        call carries on from there.
+        """
+        todo = [(t, self.model.by_type(t) or []) for t in dict.fromkeys(entity_types) if t not in self._scopes]
+        total = sum(len(elems) for _, elems in todo)
+        done = 0
+        for t, elems in todo:
+            ids = []
+            for e in elems:
+                eid = e.id()
+                ids.append(eid)
+                if eid not in self._indexed:
+                    self._indexed.add(eid)
+                    for entry in self.props.table(e):
+                        for key, vals in entry.props.items():
+                            per_name = self._by_key.setdefault(key, {})
+                            postings = per_name.get(entry.name)
+                            if postings is None:
+                                postings = per_name[entry.name] = (entry.name_lc, {})
+                            for val in vals:
+                                postings[1].setdefault(val, []).append(eid)
+                done += 1
+                if done % batch_size == 0:
+                    yield done, total
+            self._scopes[t] = ids
+            self._memo.clear()
+        if todo:
+            yield done, total
+
+    def scope(self, entity_type):
+        """Ids of the indexed elements of `entity_type`, in model.by_type() order."""
+        return self._scopes[entity_type]
+
+    def matching(self, cond):
+        """Ids of indexed elements with a pset/key value satisfying a compiled condition."""
+        memo_key = (cond.pset_lc, cond.key, cond.op, cond.value, cond.fold)
+        hit = self._memo.get(memo_key)
+        if hit is None:
+            hit = set()
+            for name_lc, values in self._by_key.get(cond.key, {}).values():
+                if cond.pset_lc not in name_lc:
                     continue
-                pset_name = pdef.Name or ""
-                for prop in pdef.HasProperties or []:
-                    if prop.is_a("IfcPropertySingleValue"):
-                        key = prop.Name or ""
-                        val = str(unwrap(getattr(prop, "NominalValue", None)) or "")
-                        index.setdefault((pset_name, key), set()).add(val)
-        if total > max_elements:
-            break
+                for val, ids in values.items():
+                    if cond.test(val.casefold() if cond.fold else val):
+                        hit.update(ids)
+            self._memo[memo_key] = hit
+        return hit
 
-    rows = []
-    for (ps, k), vals in index.items():
-        rows.append({"pset": ps, "key": k, "values": sorted(list(vals)), "count_values": len(vals)})
-    return rows
+    def candidates(self, plan):
+        """
+        Ids of the indexed elements that satisfy every condition of at least
+        one rule, or None if some rule has no conditions (everything is a
+        candidate then).
+        """
+        if any(not r.conditions for r in plan.rules):
+            return None
+        out = set()
+        for r in plan.rules:
+            sets = sorted((self.matching(c) for c in r.conditions), key=len)
+            out |= sets[0].intersection(*sets[1:])
+        return out
 
-def get_pset_names(model, entity_types=("IfcGeographicElement","IfcProduct"), max_elements=20000, max_psets=400):
-    """Collect unique Pset names (for suggestions)."""
-    names = set()
-    total = 0
-    for et in entity_types:
-        try:
-            elems = model.by_type(et) or []
-        except Exception:
-            elems = []
-        for e in elems:
-            total += 1
-            if total > max_elements:
-                break
-            for rel in getattr(e, "IsDefinedBy", []) or []:
-                pdef = getattr(rel, "RelatingPropertyDefinition", None)
-                if pdef and pdef.is_a("IfcPropertySet") and pdef.Name:
-                    names.add(pdef.Name)
-                    if len(names) >= max_psets:
-                        return sorted(names)
-        if total > max_elements:
-            break
-    return sorted(names)
+DEFAULT_INDEX_ENTITIES = [
+    "IfcGeographicElement","IfcProduct","IfcBuildingElementProxy",
+    "IfcSite","IfcBuilding","IfcBuildingStorey","IfcSpace",
+    "IfcWall","IfcSlab","IfcRoof","IfcColumn","IfcBeam","IfcMember",
+    "IfcCovering","IfcFurnishingElement","IfcDistributionElement",
+    "IfcProxy","IfcAnnotation"
+]
 
-def build_pset_index(model, entity_types=None, max_elements=30000, limit_values=1000):
+def _is_product_type(model, name):
+    """True/False if `name` is (not) an IfcProduct subtype in the model's schema; None if unknown."""
+    try:
+        decl = ifcopenshell_wrapper.schema_by_name(model.schema).declaration_by_name(name)
+    except Exception:
+        return None
+    while decl is not None:
+        if decl.name() == "IfcProduct":
+            return True
+        decl = decl.supertype() if hasattr(decl, "supertype") else None
+    return False
+
+def _concrete_types(schema, name):
+    """`name` and its non-abstract supertypes: every type whose by_type() includes instances of `name`."""
+    try:
+        decl = ifcopenshell_wrapper.schema_by_name(schema).declaration_by_name(name)
+    except Exception:
+        return [name]
+    out = []
+    while decl is not None:
+        if not decl.is_abstract():
+            out.append(decl.name())
+        decl = decl.supertype()
+    return out
+
+def _elements_in_one_pass(model, wanted, concrete=False):
     """
-    Build a nested index (for 'sensitive' dropdowns in the rule editor):
-      { entity: { pset: { key: [values...] } } }
+    Yield (element, [wanted types it is an instance of], [concrete types])
+    walking IfcProduct once; with `concrete` the last list holds the
+    element's own type and its non-abstract supertypes, else it is empty.
+    Requested types outside IfcProduct get their own by_type() walk afterwards.
+    """
+    buckets = {}
+    for e in model.by_type("IfcProduct") or []:
+        t = e.is_a()
+        hit = buckets.get(t)
+        if hit is None:
+            hit = buckets[t] = ([et for et in wanted if e.is_a(et)],
+                                _concrete_types(model.schema, t) if concrete else [])
+        yield e, hit[0], hit[1]
+    for et in wanted:
+        if _is_product_type(model, et) is False:
+            try:
+                elems = model.by_type(et) or []
+            except Exception:
+                elems = []
+            for e in elems:
+                yield e, [et], []
+
+def index_model(model, entity_types=None, max_elements=30000, limit_values=1000,
+                survey_types=("IfcGeographicElement",), survey_max_elements=20000,
+                name_types=("IfcGeographicElement","IfcProduct"), names_max_elements=20000, max_psets=400,
+                discover_max_elements=200000, include_concrete=False, props=None):
+    """
+    One traversal of the model producing what survey_psets, get_pset_names,
+    build_pset_index and discover_entity_types return:
+      {"entity_types": [...], "pset_index": {...}, "pset_names": [...], "survey": [...]}
+    plus "type_counts": {type: elements of it}, over every type elements are bucketed under.
+    Each element is bucketed under every requested type it is an instance of.
+    Caps are counted per output (pset_index per entity type, survey/names in
+    total), all over the same walk: IfcProduct in by_type() order (grouped by
+    concrete type), then other requested types. Once a cap is hit, the sample
+    is the first elements of that walk, not of a walk per requested type.
+    `include_concrete` also files every product in pset_index under each
+    discovered entity type it is an instance of (what build_pset_index()
+    over the discovered types gives, and what the app does).
+    """
+    if props is None:
+        props = PropertyTables(max_elements=0)
+    wanted = indexed_types(entity_types, survey_types, name_types)
+    rows = ((e.is_a(), e.is_a("IfcProduct"), ets, concrete, (lambda e=e: props.table(e)))
+            for e, ets, concrete in _elements_in_one_pass(model, wanted, concrete=include_concrete))
+    return build_index(rows, entity_types=entity_types, max_elements=max_elements, limit_values=limit_values,
+                       survey_types=survey_types, survey_max_elements=survey_max_elements,
+                       name_types=name_types, names_max_elements=names_max_elements, max_psets=max_psets,
+                       discover_max_elements=discover_max_elements, include_concrete=include_concrete)
+
+def indexed_types(entity_types=None, survey_types=("IfcGeographicElement",),
+                name_types=("IfcGeographicElement","IfcProduct")):
+    """Every type index_model() buckets elements under, for the same arguments."""
+    if entity_types is None:
+        entity_types = DEFAULT_INDEX_ENTITIES
+    return list(dict.fromkeys(list(entity_types) + list(survey_types or ()) + list(name_types or ())))
+
+def build_index(rows, entity_types=None, max_elements=30000, limit_values=1000,
+                survey_types=("IfcGeographicElement",), survey_max_elements=20000,
+                name_types=("IfcGeographicElement","IfcProduct"), names_max_elements=20000, max_psets=400,
+                discover_max_elements=200000, include_concrete=False):
+    """
+    index_model() over any source of elements: `rows` yields
+    (concrete type, is a product, [indexed_types() it is an instance of],
+    [its type and non-abstract supertypes, for include_concrete],
+    callable returning its PsetEntry tuple), in model order.
     """
-    default_entities = [
-        "IfcGeographicElement","IfcProduct","IfcBuildingElementProxy",
-        "IfcSite","IfcBuilding","IfcBuildingStorey","IfcSpace",
-        "IfcWall","IfcSlab","IfcRoof","IfcColumn","IfcBeam","IfcMember",
-        "IfcCovering","IfcFurnishingElement","IfcDistributionElement",
-        "IfcProxy","IfcAnnotation"
-    ]
     if entity_types is None:
-        entity_types = default_entities
+        entity_types = DEFAULT_INDEX_ENTITIES
+    entity_types = list(dict.fromkeys(entity_types))
+    survey_types = tuple(survey_types or ())
+    name_types = tuple(name_types or ())
+    index_types = set(entity_types)
 
+    seen_types = set()
+    n_products = 0
     idx = {}
-    for et in entity_types:
-        try:
-            elems = model.by_type(et) or []
-        except Exception:
-            elems = []
-        count = 0
-        for e in elems:
-            count += 1
-            if count > max_elements:
-                break
-            for rel in getattr(e, "IsDefinedBy", []) or []:
-                pdef = getattr(rel, "RelatingPropertyDefinition", None)
-                if not pdef or not pdef.is_a("IfcPropertySet"):
-                    continue
-                pset = pdef.Name or ""
-                if not pset:
-                    continue
-                et_map = idx.setdefault(et, {})
-                key_map = et_map.setdefault(pset, {})
-                for prop in pdef.HasProperties or []:
-                    if prop.is_a("IfcPropertySingleValue"):
-                        key = prop.Name or ""
-                        if not key:
-                            continue
-                        val = str(unwrap(getattr(prop, "NominalValue", None)) or "")
-                        s = key_map.setdefault(key, set())
-                        if len(s) < limit_values:
-                            s.add(val)
+    counts = {}
+    survey = {}
+    n_survey = 0
+    names = set()
+    n_names = 0
+    totals = {}
+
+    for t, is_product, ets, concrete, table in rows:
+        for et in ets:
+            totals[et] = totals.get(et, 0) + 1
+        if n_products < discover_max_elements and is_product:
+            n_products += 1
+            seen_types.add(t)
+        in_survey = n_survey < survey_max_elements and any(et in survey_types for et in ets)
+        in_names = (n_names < names_max_elements and len(names) < max_psets
+                    and any(et in name_types for et in ets))
+        idx_types = []
+        for et in ets + [c for c in concrete if c not in ets]:
+            if (et in index_types or et in concrete) and counts.get(et, 0) < max_elements:
+                counts[et] = counts.get(et, 0) + 1
+                idx_types.append(et)
+        n_survey += in_survey
+        n_names += in_names
+        if not (in_survey or in_names or idx_types):
+            continue
+
+        for entry in table():
+            if in_names and entry.name and len(names) < max_psets:
+                names.add(entry.name)
+            if in_survey:
+                for key, vals in entry.props.items():
+                    survey.setdefault((entry.name, key or ""), set()).update(vals)
+            if not entry.name:
+                continue
+            for et in idx_types:
+                key_map = idx.setdefault(et, {}).setdefault(entry.name, {})
+                for key, vals in entry.props.items():
+                    if not key:
+                        continue
+                    s = key_map.setdefault(key, set())
+                    for val in vals:
+                        if len(s) >= limit_values:
+                            break
+                        s.add(val)
+
+    if include_concrete:
+        # supertypes with no instances of their own are not discovered entity types
+        for et in [et for et in idx if et not in index_types and et not in seen_types]:
+            del idx[et]
 
     # Convert sets to sorted lists
     for et in idx:
@@ -119,7 +360,35 @@ def build_pset_index(model, entity_types=None, max_elements=30000, limit_values=
             for k in idx[et][ps]:
                 idx[et][ps][k] = sorted(idx[et][ps][k])
 
-    return idx
+    rows = []
+    for (ps, k), vals in survey.items():
+        rows.append({"pset": ps, "key": k, "values": sorted(list(vals)), "count_values": len(vals)})
+
+    return {
+        "entity_types": sorted(seen_types),
+        "pset_index": idx,
+        "pset_names": sorted(names),
+        "survey": rows,
+        "type_counts": totals,
+    }
+
+def survey_psets(model, entity_types=("IfcGeographicElement",), limit_values=100, max_elements=20000):
+    """Return a flat list of {pset,key,values,count_values} for quick inspection."""
+    return index_model(model, entity_types=[], survey_types=entity_types, survey_max_elements=max_elements,
+                       name_types=(), discover_max_elements=0)["survey"]
+
+def get_pset_names(model, entity_types=("IfcGeographicElement","IfcProduct"), max_elements=20000, max_psets=400):
+    """Collect unique Pset names (for suggestions)."""
+    return index_model(model, entity_types=[], survey_types=(), name_types=entity_types,
+                       names_max_elements=max_elements, max_psets=max_psets, discover_max_elements=0)["pset_names"]
+
+def build_pset_index(model, entity_types=None, max_elements=30000, limit_values=1000):
+    """
+    Build a nested index (for 'sensitive' dropdowns in the rule editor):
+      { entity: { pset: { key: [values...] } } }
+    """
+    return index_model(model, entity_types=entity_types, max_elements=max_elements, limit_values=limit_values,
+                       survey_types=(), name_types=(), discover_max_elements=0)["pset_index"]
 
 def discover_entity_types(model, base_types=("IfcProduct",), max_elements=200000):
     """
@@ -138,4 +407,4 @@ def discover_entity_types(model, base_types=("IfcProduct",), max_elements=200000
             t = e.is_a()
             if t:
                 seen.add(t)
-    return sorted(seen)
\ No newline at end of file
+    return sorted(seen)
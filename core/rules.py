@@ -1,28 +1,226 @@
 # core/rules.py
 import re
-from core.psets import iter_pset_values  # <-- fixed import
-
-def _cmp(a, op, b, case):
-    if a is None: a = ""
-    if b is None: b = ""
-    if case == "insensitive":
-        a, b = str(a).casefold(), str(b).casefold()
-    if op == "equals":   return a == b
-    if op == "contains": return b in a
-    if op == "regex":    return re.search(b, a) is not None
+import json
+import time
+from collections import namedtuple
+from core.psets import PropertyTables
+from utils.colors import parse_color
+
+WILDCARDS = ("*", "All", "Any")
+OPS = ("equals", "contains", "regex")
+
+# ---------- compiled form ----------
+# test(value) -> bool runs against the raw property string; `fold` says whether
+# the value must be casefolded first (the needle already is).
+CompiledCondition = namedtuple("CompiledCondition", "pset pset_lc key op value fold test")
+CompiledRule = namedtuple("CompiledRule", "index entity conditions rgb rule")
+
+def _text(obj, field):
+    value = obj.get(field)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{field} must be a string, not {type(value).__name__}")
+    return value
+
+def _compile_condition(cond):
+    if not isinstance(cond, dict):
+        raise ValueError(f"expected an object, not {type(cond).__name__}")
+    op = _text(cond, "op") or "equals"
+    if op not in OPS:
+        raise ValueError(f"unknown op {op!r}")
+    fold = cond.get("case", "insensitive") == "insensitive"
+    value = cond.get("value")
+    if value is None:
+        value = ""
+    if fold:
+        value = str(value).casefold()
+    if op == "equals":
+        test = value.__eq__ if isinstance(value, str) else (lambda a, b=value: a == b)
+    elif op == "contains":
+        needle = str(value)
+        test = lambda a, n=needle: n in a
+    else:
+        try:
+            rx = re.compile(value)
+        except (re.error, TypeError) as e:
+            raise ValueError(f"bad regex {value!r}: {e}") from None
+        test = lambda a, s=rx.search: s(a) is not None
+    pset = _text(cond, "pset") or ""
+    return CompiledCondition(pset, pset.lower(), _text(cond, "key") or "", op, value, fold, test)
+
+def _strip_internal(obj):
+    if isinstance(obj, dict):
+        return {k: _strip_internal(v) for k, v in obj.items() if not str(k).startswith("_")}
+    if isinstance(obj, list):
+        return [_strip_internal(x) for x in obj]
+    return obj
+
+def rule_keys(rules):
+    """
+    Stable identity per rule: (_id, content without internal keys). Rules
+    without an _id fall back to content plus occurrence number.
+    """
+    keys, seen = [], {}
+    for r in rules:
+        content = json.dumps(_strip_internal(r), sort_keys=True, ensure_ascii=False, default=str)
+        base = (r.get("_id"), content)
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        keys.append(base if n == 0 else base + (n,))
+    return tuple(keys)
+
+def _compile_entity(rule):
+    ent = (_text(rule, "entity") or "").strip()
+    return None if (not ent or ent in WILDCARDS) else ent
+
+def compile_rule(rule, index=0, with_color=True):
+    """Compile one rule dict; raises ValueError naming the rule/condition on bad input."""
+    conditions = rule.get("conditions") or []
+    if not isinstance(conditions, (list, tuple)):
+        raise ValueError(f"rule #{index+1}: conditions must be a list, not {type(conditions).__name__}")
+    try:
+        entity = _compile_entity(rule)
+    except ValueError as e:
+        raise ValueError(f"rule #{index+1}: {e}") from None
+    conds = []
+    for j, cond in enumerate(conditions):
+        try:
+            conds.append(_compile_condition(cond))
+        except ValueError as e:
+            raise ValueError(f"rule #{index+1}, condition #{j+1}: {e}") from None
+    rgb = None
+    if with_color:
+        try:
+            rgb = tuple(float(x) for x in parse_color(rule.get("color") or {}))
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            raise ValueError(f"rule #{index+1}: bad color {rule.get('color')!r}: {e}") from None
+        if len(rgb) != 3:
+            raise ValueError(f"rule #{index+1}: bad color {rule.get('color')!r}: expected 3 channels")
+    return CompiledRule(index, entity, tuple(conds), rgb, rule)
+
+def _cond_hit(table, cond):
+    needle = cond.pset_lc
+    for entry in table:
+        if needle in entry.name_lc:
+            for val in (entry.folded if cond.fold else entry.props).get(cond.key, ()):
+                if cond.test(val):
+                    return True
     return False
 
+class RulePlan:
+    """
+    Immutable, pre-validated form of a rules list: regexes compiled,
+    comparison values normalized, colours parsed. Entity checks are
+    resolved once per concrete IFC type and remembered.
+    """
+    def __init__(self, rules):
+        if rules is None:
+            rules = []
+        if not isinstance(rules, (list, tuple)):
+            raise ValueError(f"rules must be a list of rule objects, not {type(rules).__name__}")
+        for i, r in enumerate(rules):
+            if not isinstance(r, dict):
+                raise ValueError(f"rule #{i+1}: expected an object, not {type(r).__name__}")
+        self.rules = tuple(compile_rule(r, i) for i, r in enumerate(rules))
+        self.keys = rule_keys(rules)
+        self.wildcard = any(r.entity is None for r in self.rules)
+        self.entities = tuple(dict.fromkeys(r.entity for r in self.rules if r.entity))
+        self._types = {}
+        self._type_stats = [0, 0]
+        # set for the duration of a profiled run (see RecolorSession.run)
+        self.profiler = None
+        # Value dispatch: every rule with an `equals` condition is filed under
+        # (pset, key, fold) -> value -> [rules in order]; the rest are scanned.
+        # A rule can only match if its equals value is present on the element,
+        # so the lookup yields exactly the candidates the linear scan would hit.
+        self._families = {}
+        self._scan = []
+        for r in self.rules:
+            eq = next((c for c in r.conditions
+                       if c.op == "equals" and isinstance(c.value, (str, int, float))), None)
+            if eq is None:
+                self._scan.append(r)
+                continue
+            fam = self._families.setdefault((eq.pset_lc, eq.key, eq.fold), {})
+            fam.setdefault(eq.value, []).append(r)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def types_for(self, element):
+        """Return the rule entity names `element` is an instance of."""
+        t = element.is_a()
+        hit = self._types.get(t)
+        if hit is None:
+            self._type_stats[1] += 1
+            hit = self._types[t] = frozenset(ent for ent in self.entities if element.is_a(ent))
+        else:
+            self._type_stats[0] += 1
+        return hit
+
+    def cache_info(self):
+        return {"entity_types": {"hits": self._type_stats[0], "misses": self._type_stats[1]}}
+
+    def first_of(self, table, types, indices):
+        """Like match_table() but only tries the rules at `indices` (ascending)."""
+        for i in indices:
+            rule = self.rules[i]
+            if self.rule_matches(rule, table, types):
+                return rule
+        return None
+
+    def rule_matches(self, rule, table, types):
+        """`table` is the element's PropertyTables table, `types` its types_for()."""
+        if self.profiler is not None:
+            start = time.perf_counter()
+            hit = self._rule_matches(rule, table, types)
+            self.profiler.rule_eval(rule.index, time.perf_counter() - start, hit)
+            return hit
+        return self._rule_matches(rule, table, types)
+
+    def _rule_matches(self, rule, table, types):
+        if rule.entity is not None and rule.entity not in types:
+            return False
+        for cond in rule.conditions:
+            if not _cond_hit(table, cond):
+                return False
+        return True
+
+    def first_match(self, element, props=None):
+        """Return the first CompiledRule matching `element`, or None."""
+        if props is None:
+            props = PropertyTables(max_elements=1)
+        return self.match_table(props.table(element), self.types_for(element))
+
+    def match_table(self, table, types):
+        """first_match() on an already extracted table; order is first-match-wins."""
+        best = None
+        for (pset_lc, key, fold), fam in self._families.items():
+            for entry in table:
+                if pset_lc not in entry.name_lc:
+                    continue
+                for val in (entry.folded if fold else entry.props).get(key, ()):
+                    for rule in fam.get(val, ()):
+                        if best is not None and rule.index >= best.index:
+                            break
+                        if self.rule_matches(rule, table, types):
+                            best = rule
+                            break
+        for rule in self._scan:
+            if best is not None and rule.index >= best.index:
+                break
+            if self.rule_matches(rule, table, types):
+                return rule
+        return best
+
+def compile_rules(rules):
+    """Return a RulePlan for `rules` (a RulePlan is passed through unchanged)."""
+    if isinstance(rules, RulePlan):
+        return rules
+    return RulePlan(rules)
+
 def matches(element, rule):
-    ent = (rule.get("entity") or "").strip()
-    # "*" / "All" / "Any" means no entity restriction
-    if ent and ent not in ("*", "All", "Any") and not element.is_a(ent):
+    cr = compile_rule(rule, with_color=False)
+    if cr.entity is not None and not element.is_a(cr.entity):
         return False
-    for cond in rule.get("conditions", []):
-        hit = False
-        for val in iter_pset_values(element, cond["pset"], cond["key"]):
-            if _cmp(val, cond["op"], cond["value"], cond.get("case","insensitive")):
-                hit = True
-                break
-        if not hit:
-            return False
-    return True
+    table = PropertyTables(max_elements=1).table(element)
+    return all(_cond_hit(table, cond) for cond in cr.conditions)
@@ -0,0 +1,381 @@
+# core/step.py
+"""
+Byte-level access to ISO 10303-21 (STEP / .ifc) text: where each entity
+record of the DATA section starts and ends, so an export can copy the
+original file and rewrite only the records that changed.
+"""
+import mmap
+import re
+
+import numpy as np
+from ifcopenshell import ifcopenshell_wrapper
+
+from core.psets import _make_entry, build_index, indexed_types
+
+# one statement up to its terminating ';' — strings ('' escapes included) and /* */ comments may hold ';'.
+# Every piece is taken atomically, (?=(?P<x>...))(?P=x) being `...` without backtracking into it
+# (like ++ on Python 3.11+): with choices left in, a tail with no ';' backtracks exponentially.
+_STATEMENT = re.compile(
+    rb"(?=(?P<lead>(?:\s|/\*.*?\*/)*))(?P=lead)(?:\#(?P<id>\d+)\s*=)?"
+    rb"(?:(?=(?P<run>[^;'/]+))(?P=run)|'[^']*'|(?=(?P<comment>/\*.*?\*/))(?P=comment)|/(?!\*))*;", re.S)
+_COMMENT = re.compile(rb"/\*.*?\*/", re.S)
+
+class StepOffsets:
+    """
+    Byte span [start, end) of every `#id=...;` record in a STEP file, plus
+    the offset of the ENDSEC closing its (last) DATA section. Built with one
+    pass over the bytes; ids are kept as sorted int64 arrays.
+    """
+    def __init__(self, ids, starts, ends, data_end, newline=b"\n"):
+        order = np.argsort(ids, kind="stable")
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.starts = np.asarray(starts, dtype=np.int64)[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.data_end = data_end
+        self.newline = newline
+
+    @classmethod
+    def scan(cls, data):
+        """Index bytes-like `data`; ValueError if it has no DATA section."""
+        ids, starts, ends = [], [], []
+        data_end = None
+        in_data = False
+        pos = 0
+        while True:
+            # statement by statement: whatever follows the last ';' (no terminator, trailing junk) is skipped
+            m = _STATEMENT.match(data, pos)
+            if m is None:
+                break
+            pos = m.end()
+            if m.start("id") >= 0:
+                ids.append(int(m.group("id")))
+                starts.append(m.start("id") - 1)
+                ends.append(m.end())
+                continue
+            keyword = _COMMENT.sub(b"", m.group(0)).strip()
+            if keyword.startswith(b"DATA"):
+                in_data = True
+            elif keyword == b"ENDSEC;" and in_data:
+                data_end = m.end() - len(b"ENDSEC;")
+                in_data = False
+        if data_end is None:
+            raise ValueError("no DATA section")
+        newline = b"\r\n" if b"\r\n" in bytes(data[:4096]) else b"\n"
+        return cls(ids, starts, ends, data_end, newline)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def spans(self, entity_ids):
+        """[(start, end, id)] for the given ids, in file order; KeyError for an id not in the file."""
+        want = np.asarray(sorted(set(entity_ids)), dtype=np.int64)
+        pos = np.searchsorted(self.ids, want)
+        found = pos < len(self.ids)
+        found[found] = self.ids[pos[found]] == want[found]
+        if not found.all():
+            raise KeyError(int(want[~found][0]))
+        out = list(zip(self.starts[pos].tolist(), self.ends[pos].tolist(), want.tolist()))
+        out.sort()
+        return out
+
+def _record(model, eid):
+    return model.by_id(eid).to_string().encode("utf-8") + b";"
+
+def iter_patched(model, data, offsets, changed=(), added=()):
+    """
+    Yield the bytes of `data` (the file `model` was parsed from, indexed by
+    `offsets`) with the records of `changed` ids re-serialized from the
+    model and the `added` records inserted before the DATA ENDSEC.
+    Everything else is passed through unchanged, as slices of `data`.
+    """
+    view = memoryview(data)
+    pos = 0
+    for start, end, eid in offsets.spans(changed):
+        yield view[pos:start]
+        yield _record(model, eid)
+        pos = end
+    yield view[pos:offsets.data_end]
+    for eid in added:
+        yield _record(model, eid) + offsets.newline
+    yield view[offsets.data_end:]
+
+# ---------- property scan ----------
+
+_SCHEMA = re.compile(rb"FILE_SCHEMA\s*\(\s*\(\s*'([^']*)'")
+_WS = rb"(?:\s|/\*.*?\*/)*"
+_TOKEN = re.compile(_WS + rb"""(?:
+    '([^']*(?:''[^']*)*)'                         # 1 string
+  | \#(\d+)                                       # 2 reference
+  | ([A-Z_][A-Z0-9_]*)""" + _WS + rb"""\(         # 3 typed value
+  | (\()                                          # 4 list
+  | (\))                                          # 5 end of list / typed value / record
+  | \.([A-Z_][A-Z0-9_]*)\.                        # 6 enumeration
+  | ([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)  # 7 number
+  | ([$*])                                        # 8 unset
+  | (,)
+  | "([0-9A-Fa-f]*)"                              # 10 binary
+)""", re.X | re.S)
+_ESCAPE = re.compile(r"\\P([A-I])\\|\\S\\(.)|\\X\\([0-9A-F]{2})|\\X2\\((?:[0-9A-F]{4})*)\\X0\\"
+                     r"|\\X4\\((?:[0-9A-F]{8})*)\\X0\\|\\\\", re.S)
+
+class _Ref(int):
+    """An entity reference (#id) among decoded attribute values."""
+
+def _decode_string(raw):
+    text = raw.replace(b"''", b"'").decode("utf-8", "replace")
+    if "\\" not in text:
+        return text
+    page = ["iso8859-1"]
+
+    def sub(m):
+        if m.group(1):
+            page[0] = f"iso8859-{ord(m.group(1)) - 64}"
+            return ""
+        if m.group(2) is not None:
+            return bytes([ord(m.group(2)) + 128]).decode(page[0], "replace")
+        if m.group(3):
+            return bytes.fromhex(m.group(3)).decode("iso8859-1")
+        if m.group(4) is not None:
+            return bytes.fromhex(m.group(4)).decode("utf-16-be", "replace")
+        if m.group(5) is not None:
+            return bytes.fromhex(m.group(5)).decode("utf-32-be", "replace")
+        return "\\"
+    return _ESCAPE.sub(sub, text)
+
+_ENUMS = {"T": True, "F": False, "U": "UNKNOWN"}
+
+# one-match fast paths for the usual shapes of the three decoded records; anything else goes through _parse_args.
+# Strings are spelled '[^']*(?:''[^']*)*' rather than '(?:[^']|'')*': same language, no per-byte alternation.
+_STR = rb"'([^']*(?:''[^']*)*)'"
+_OPT = rb"(?:'[^']*(?:''[^']*)*'|\$|\#\d+)"
+_REFS = rb"\(([#\d,\s]*)\)"
+_FAST = {
+    "IFCPROPERTYSINGLEVALUE": re.compile(
+        rb"\s*(?:" + _STR + rb"|\$)\s*,\s*" + _OPT + rb"\s*,\s*(?:\$|([A-Z][A-Z0-9_]*)\s*\(\s*(?:"
+        + _STR + rb"|\.([A-Z_][A-Z0-9_]*)\.|([-+]?[\d.]+(?:[eE][-+]?\d+)?))\s*\))\s*,"),
+    "IFCPROPERTYSET": re.compile(
+        rb"\s*" + _OPT + rb"\s*,\s*" + _OPT + rb"\s*,\s*(?:" + _STR + rb"|\$)\s*,\s*" + _OPT + rb"\s*,\s*"
+        + _REFS + rb"\s*\)"),
+    "IFCRELDEFINESBYPROPERTIES": re.compile(
+        rb"\s*" + _OPT + rb"\s*,\s*" + _OPT + rb"\s*,\s*" + _OPT + rb"\s*,\s*" + _OPT + rb"\s*,\s*"
+        + _REFS + rb"\s*,\s*#(\d+)\s*\)"),
+}
+
+def _refs(text):
+    return [_Ref(x) for x in re.findall(rb"\d+", text)]
+
+def _fast_args(name, data, pos, decode=_decode_string):
+    """The attributes scan_index needs, as _parse_args would give them, or None if the record is unusual."""
+    m = _FAST[name].match(data, pos)
+    if m is None:
+        return None
+    g = m.groups()
+    if name == "IFCPROPERTYSET":
+        return [None, None, None if g[0] is None else decode(g[0]), None, _refs(g[1])]
+    if name == "IFCRELDEFINESBYPROPERTIES":
+        return [None, None, None, None, _refs(g[0]), _Ref(g[1])]
+    raw_key, typed, text, enum, num = g
+    key = None if raw_key is None else decode(raw_key)
+    if typed is None:
+        value = None
+    elif text is not None:
+        value = decode(text)
+    elif enum is not None:
+        enum = enum.decode("ascii")
+        value = _ENUMS.get(enum, enum)
+    else:
+        value = float(num) if b"." in num or b"E" in num.upper() else int(num)
+    return [key, None, value]
+
+def _parse_args(data, pos):
+    """Decode the attribute list of the record whose '(' ends at `pos`; typed values are unwrapped."""
+    stack = [[]]
+    typed = [False]
+    while True:
+        m = _TOKEN.match(data, pos)
+        if m is None:
+            raise ValueError(f"cannot decode STEP record at byte {pos}")
+        pos = m.end()
+        kind = m.lastindex
+        if kind == 5:
+            value = stack.pop()
+            value = value[0] if typed.pop() and value else value
+            if not stack:
+                return value
+            stack[-1].append(value)
+        elif kind in (3, 4):
+            stack.append([])
+            typed.append(kind == 3)
+        elif kind == 1:
+            stack[-1].append(_decode_string(m.group(1)))
+        elif kind == 2:
+            stack[-1].append(_Ref(m.group(2)))
+        elif kind == 6:
+            name = m.group(6).decode("ascii")
+            stack[-1].append(_ENUMS.get(name, name))
+        elif kind == 7:
+            num = m.group(7)
+            stack[-1].append(float(num) if b"." in num or b"E" in num.upper() else int(num))
+        elif kind == 8:
+            stack[-1].append(None)
+        elif kind == 10:
+            stack[-1].append(m.group(10).decode("ascii"))
+
+def _value_text(value):
+    # what str(unwrap(NominalValue) or "") gives for the parsed model
+    if isinstance(value, list):
+        value = tuple(value)
+    return str(value or "")
+
+def _alternation(names):
+    """Regex matching exactly one of `names`, factored by common prefix so it stays fast for hundreds."""
+    root = {}
+    for name in names:
+        node = root
+        for ch in name:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def render(node):
+        alts = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+    return render(root)
+
+_QUOTE_OR_COMMENT = re.compile(rb"'|/\*|\*/")
+
+def _state_after(text, state):
+    """Whether the end of `text` is in "code", a "string" or a "comment", given where its start is."""
+    if state != "comment" and b"/*" not in text:
+        # '' escapes flip twice
+        return state if text.count(b"'") % 2 == 0 else ("string" if state == "code" else "code")
+    for m in _QUOTE_OR_COMMENT.finditer(text):
+        tok = m.group()
+        if state == "comment":
+            if tok == b"*/":
+                state = "code"
+        elif tok == b"'":
+            state = "code" if state == "string" else "string"
+        elif state == "code" and tok == b"/*":
+            state = "comment"
+    return state
+
+def _schema_of(data):
+    m = _SCHEMA.search(bytes(data[:65536]))
+    if m is None:
+        raise ValueError("no FILE_SCHEMA in header")
+    return ifcopenshell_wrapper.schema_by_name(m.group(1).decode("ascii").upper())
+
+def _subtypes(decl):
+    yield decl
+    for sub in decl.subtypes():
+        yield from _subtypes(sub)
+
+def scan_index(data, **params):
+    """
+    core.psets.index_model() computed from the STEP text instead of a parsed
+    model: one regex pass that stops only at products (and other indexed
+    types), IfcRelDefinesByProperties, IfcPropertySet and
+    IfcPropertySingleValue records; geometry and everything else is skipped
+    by type name without being decoded; `#n=` inside a string or comment is
+    not taken for a record. Takes index_model's keyword
+    arguments (except `props`). Elements are visited in file order, so
+    where a cap is reached the sample can differ from index_model's.
+    """
+    wanted = indexed_types(params.get("entity_types"), params.get("survey_types", ("IfcGeographicElement",)),
+                           params.get("name_types", ("IfcGeographicElement", "IfcProduct")))
+    concrete = params.get("include_concrete", False)
+    schema = _schema_of(data)
+    product = schema.declaration_by_name("IfcProduct")
+    types = {}
+    for et in wanted:
+        try:
+            decl = schema.declaration_by_name(et)
+        except Exception:
+            continue
+        for sub in _subtypes(decl):
+            types.setdefault(sub.name().upper(), sub)
+    for sub in _subtypes(product):
+        types.setdefault(sub.name().upper(), sub)
+    ets_of = {}
+    for key, decl in types.items():
+        supers = []
+        d = decl
+        while d is not None:
+            supers.append(d)
+            d = d.supertype()
+        names = {d.name() for d in supers}
+        ets = [et for et in wanted if et in names]
+        product_type = "IfcProduct" in names
+        chain = [d.name() for d in supers if not d.is_abstract()] if concrete and product_type else []
+        ets_of[key] = (decl.name(), product_type, ets, chain)
+
+    record = re.compile(rb"#(\d+)\s*=\s*(" + _alternation(list(types) + list(_FAST)).encode("ascii")
+                        + rb")\s*\(")
+    elements = []
+    defined_by = {}
+    psets = {}
+    values = {}
+    strings = {}
+
+    def decode(raw):
+        text = strings.get(raw)
+        if text is None:
+            text = strings[raw] = _decode_string(raw)
+        return text
+
+    state, last = "code", 0
+    for m in record.finditer(data):
+        state = _state_after(data[last:m.start()], state)
+        last = pos = m.end()
+        if state != "code":
+            continue
+        name = m.group(2).decode("ascii")
+        eid = int(m.group(1))
+        if name in types:
+            elements.append((eid, name))
+        if name not in _FAST:
+            continue
+        args = _fast_args(name, data, pos, decode) or _parse_args(data, pos)
+        if name == "IFCPROPERTYSINGLEVALUE":
+            values[eid] = (args[0], _value_text(args[2]))
+        elif name == "IFCPROPERTYSET":
+            psets[eid] = (args[2] or "", args[4] or [])
+        elif isinstance(args[5], _Ref):
+            for obj in args[4] or []:
+                defined_by.setdefault(obj, []).append(args[5])
+
+    entries = {}
+
+    def entry(pid):
+        hit = entries.get(pid)
+        if hit is None:
+            name, refs = psets[pid]
+            props = {}
+            for ref in refs:
+                if ref in values:
+                    key, val = values[ref]
+                    props.setdefault(key, []).append(val)
+            hit = entries[pid] = _make_entry(name, props)
+        return hit
+
+    def table(eid):
+        return tuple(entry(pid) for pid in defined_by.get(eid, ()) if pid in psets)
+
+    rows = []
+    # products first, then any other indexed types, like index_model
+    for is_product in (True, False):
+        for eid, key in elements:
+            t, product_type, ets, chain = ets_of[key]
+            if product_type != is_product:
+                continue
+            rows.append((t, product_type, ets, chain, (lambda eid=eid: table(eid))))
+    params.pop("props", None)
+    return build_index(rows, **params)
+
+def scan_index_file(path, **params):
+    """scan_index() of an IFC file, read through mmap."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return scan_index(data, **params)
@@ -4,6 +4,14 @@ def hex_to_rgb01(h):
     return (r/255.0, g/255.0, b/255.0)
 
 def parse_color(cobj):
-    if "hex" in cobj: return hex_to_rgb01(cobj["hex"])
-    if "rgb" in cobj: return tuple(cobj["rgb"])
+    if not isinstance(cobj, dict):
+        raise ValueError("color must be an object with hex or rgb")
+    if "hex" in cobj:
+        if not isinstance(cobj["hex"], str):
+            raise ValueError("hex must be a string")
+        return hex_to_rgb01(cobj["hex"])
+    if "rgb" in cobj:
+        if not isinstance(cobj["rgb"], (list, tuple)):
+            raise ValueError("rgb must be a list of 3 numbers")
+        return tuple(cobj["rgb"])
     raise ValueError("color requires hex or rgb")
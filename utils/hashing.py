@@ -0,0 +1,39 @@
+# utils/hashing.py
+"""
+Content hashes used as cache keys (model pool, on-disk index cache).
+xxHash (XXH3-128, many GB/s) when the optional `xxhash` package is
+installed, else BLAKE2b-128 from hashlib (a little faster than md5).
+Digests carry the algorithm name so keys made with different ones never
+collide.
+"""
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CHUNK_SIZE = 1 << 20
+HASH_NAME = "xxh3" if xxhash is not None else "blake2b"
+
+def new_hasher():
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+
+def digest(hasher):
+    return f"{HASH_NAME}-{hasher.hexdigest()}"
+
+def hash_bytes(data):
+    h = new_hasher()
+    h.update(data)
+    return digest(h)
+
+def hash_stream(fobj, chunk_size=CHUNK_SIZE):
+    """Hash a binary file object chunk by chunk from its current position."""
+    h = new_hasher()
+    for chunk in iter(lambda: fobj.read(chunk_size), b""):
+        h.update(chunk)
+    return digest(h)
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        return hash_stream(f, chunk_size)
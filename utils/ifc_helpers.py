@@ -1,4 +1,5 @@
 # utils/ifc_helpers.py
+from utils.profiling import NULL_PROFILER
 
 def unwrap(v):
     return getattr(v, "wrappedValue", v)
@@ -89,29 +90,255 @@ def _iter_material_objects(m):
                 else:
                     yield from _iter_material_objects(sub)
 
-def material_styles_for_product(model, product, include_type=True):
+class MaterialStyleIndex:
+    """
+    One-time index: object (instance or type) id -> its IfcRelAssociatesMaterial,
+    plus a memoized material -> surface styles expansion.
+    Build once per model and reuse it across dry-run and apply.
+    """
+    def __init__(self, model, item_styles=None):
+        self._rels = {}
+        self._styles = {}
+        self._items = {}
+        self._item_styles = item_styles or _styles_for_item
+        self._stats = [0, 0]
+        for rel in model.by_type("IfcRelAssociatesMaterial") or []:
+            for obj in getattr(rel, "RelatedObjects", []) or []:
+                if obj:
+                    self._rels.setdefault(obj.id(), []).append(rel)
+
+    def items_for_material(self, mat):
+        """Return the items of all material styled representations reachable from `mat`."""
+        if not mat:
+            return ()
+        hit = self._items.get(mat.id())
+        self._stats[hit is None] += 1
+        if hit is None:
+            out = []
+            for m in _iter_material_objects(mat):
+                for mdr in getattr(m, "HasRepresentation", []) or []:
+                    for sr in getattr(mdr, "Representations", []) or []:
+                        out.extend(it for it in (getattr(sr, "Items", []) or []) if it)
+            hit = self._items[mat.id()] = tuple(out)
+        return hit
+
+    def styles_for_material(self, mat):
+        """Return the styles of all material styled representations reachable from `mat`."""
+        if not mat:
+            return ()
+        hit = self._styles.get(mat.id())
+        if hit is None:
+            out = []
+            for it in self.items_for_material(mat):
+                out.extend(self._item_styles(it))
+            hit = self._styles[mat.id()] = tuple(out)
+        return hit
+
+    def materials_for_product(self, product, include_type=True):
+        """RelatingMaterial of every association of the product (and its type), in model order."""
+        targets = [product]
+        if include_type:
+            for reltyp in (getattr(product, "IsTypedBy", []) or []):
+                t = getattr(reltyp, "RelatingType", None)
+                if t:
+                    targets.append(t)
+        rels = {}
+        for t in targets:
+            for rel in self._rels.get(t.id(), ()):
+                rels[rel.id()] = rel
+        # one entry per association (as the full scan did)
+        return [getattr(rels[rid], "RelatingMaterial", None) for rid in sorted(rels)]
+
+    def cache_info(self):
+        return {"material_items": {"hits": self._stats[0], "misses": self._stats[1]}}
+
+    def styles_for_product(self, product, include_type=True):
+        for mat in self.materials_for_product(product, include_type=include_type):
+            yield from self.styles_for_material(mat)
+
+def material_styles_for_product(model, product, include_type=True, index=None):
     """
     Yield surface styles coming from material styled representations
     associated to the product and (optionally) its type.
+    Pass a MaterialStyleIndex when calling this for many products.
+    """
+    if index is None:
+        index = MaterialStyleIndex(model)
+    yield from index.styles_for_product(product, include_type=include_type)
+
+def _surface_styles_in(container):
+    """IfcSurfaceStyle entities held by a style container (IfcSurfaceStyle or assignment)."""
+    if not container:
+        return
+    if container.is_a("IfcPresentationStyleAssignment"):
+        for s in getattr(container, "Styles", []) or []:
+            if s and s.is_a("IfcSurfaceStyle"):
+                yield s
+    elif container.is_a("IfcSurfaceStyle"):
+        yield container
+
+class StyleGraph:
+    """
+    Product -> surface styles, precomputed instead of walked per product.
+    One sweep over IfcStyledItem maps each representation item to its
+    styled items and their rendering/shading entities, each
+    IfcRepresentationMap is resolved once however many IfcMappedItem
+    instances reuse it, and the per-product result (surface + material
+    styles) is memoized. Build once per model and share it between dry-run
+    and apply. The sweep also records which styled items use each
+    IfcSurfaceStyle and through which container, for style splitting.
     """
-    # collect targets: instance and (optionally) its type object(s)
-    targets = {product}
-    if include_type:
-        for reltyp in (getattr(product, "IsTypedBy", []) or []):
-            t = getattr(reltyp, "RelatingType", None)
-            if t:
-                targets.add(t)
-
-    # walk material associations that reference any of those targets
-    for rel in model.by_type("IfcRelAssociatesMaterial") or []:
-        objs = set(getattr(rel, "RelatedObjects", []) or [])
-        if not (objs & targets):
-            continue
-        mat = getattr(rel, "RelatingMaterial", None)
-        for m in _iter_material_objects(mat):
-            for mdr in getattr(m, "HasRepresentation", []) or []:
-                for sr in getattr(mdr, "Representations", []) or []:
-                    for it in getattr(sr, "Items", []) or []:
-                        # reuse your existing item -> styles function
-                        for sty in _styles_for_item(it):
-                            yield sty
+    def __init__(self, model, materials=None):
+        self._rends = {}
+        self._si_by_item = {}
+        self._users = {}
+        self._containers = {}
+        self._surface = {}
+        for si in model.by_type("IfcStyledItem") or []:
+            rends = []
+            surface = []
+            for c in getattr(si, "Styles", []) or []:
+                rends.extend(_renderings_from_style_container(c))
+                for sty in _surface_styles_in(c):
+                    if (si.id(), sty.id()) not in self._containers:
+                        self._users.setdefault(sty.id(), []).append(si)
+                        self._containers[(si.id(), sty.id())] = c
+                        surface.append(sty)
+            self._rends[si.id()] = tuple(rends)
+            self._surface[si.id()] = tuple(surface)
+            item = getattr(si, "Item", None)
+            if item is not None and rends:
+                self._si_by_item.setdefault(item.id(), []).append(si)
+        self._setup(model, materials)
+
+    def _setup(self, model, materials):
+        self.model = model
+        self.materials = materials if materials is not None else MaterialStyleIndex(model, item_styles=self.item_styles)
+        self.profiler = NULL_PROFILER
+        self._maps = {}
+        self._products = {}
+        self._stats = {"mapped_sources": [0, 0], "product_styles": [0, 0]}
+
+    def export_state(self):
+        """
+        Plain-data snapshot of the sweep and the products resolved so far, as
+        entity ids (see from_state). Per styled item: its item id (0 if none),
+        rendering ids, and (IfcSurfaceStyle id, container id) pairs.
+        """
+        items = []
+        for sid, rends in self._rends.items():
+            item = getattr(self.model.by_id(sid), "Item", None)
+            items.append([sid, item.id() if item is not None else 0, [r.id() for r in rends],
+                          [[sty.id(), self._containers[(sid, sty.id())].id()] for sty in self._surface[sid]]])
+        return {
+            "styled_items": items,
+            "products": [[pid, [si.id() for si in sis]] for pid, (sis, _) in self._products.items()],
+        }
+
+    @classmethod
+    def from_state(cls, model, state, materials=None):
+        """StyleGraph of `model` rebuilt from export_state() without sweeping it again."""
+        g = cls.__new__(cls)
+        g._rends, g._si_by_item, g._users, g._containers, g._surface = {}, {}, {}, {}, {}
+        by_id = model.by_id
+        sis = {}
+        for sid, item_id, rend_ids, pairs in state["styled_items"]:
+            si = sis[sid] = by_id(sid)
+            rends = g._rends[sid] = tuple(by_id(r) for r in rend_ids)
+            surface = []
+            for sty_id, cont_id in pairs:
+                sty = by_id(sty_id)
+                g._users.setdefault(sty_id, []).append(si)
+                g._containers[(sid, sty_id)] = by_id(cont_id)
+                surface.append(sty)
+            g._surface[sid] = tuple(surface)
+            if item_id and rends:
+                g._si_by_item.setdefault(item_id, []).append(si)
+        g._setup(model, materials)
+        for pid, si_ids in state["products"]:
+            prod_sis = tuple(sis[i] for i in si_ids)
+            styles = []
+            for si in prod_sis:
+                styles.extend(g._rends[si.id()])
+            g._products[pid] = (prod_sis, tuple(styles))
+        return g
+
+    def cache_info(self):
+        info = {k: {"hits": h, "misses": m} for k, (h, m) in self._stats.items()}
+        info.update(self.materials.cache_info())
+        return info
+
+    def item_styled(self, item):
+        """Styled items carrying the styles of `item` (the item itself if it is one)."""
+        if not item:
+            return ()
+        if item.id() in self._rends:
+            return (item,)
+        return self._si_by_item.get(item.id(), ())
+
+    def item_styles(self, item):
+        """Same result as _styles_for_item(item), from the sweep."""
+        out = ()
+        for si in self.item_styled(item):
+            out += self._rends[si.id()]
+        return out
+
+    def mapped_styled(self, src):
+        """Styled items of an IfcRepresentationMap's items, resolved once per map."""
+        hit = self._maps.get(src.id())
+        self._stats["mapped_sources"][hit is None] += 1
+        if hit is None:
+            out = []
+            mrep = getattr(src, "MappedRepresentation", None)
+            if mrep:
+                for src_item in mrep.Items or []:
+                    out.extend(self.item_styled(src_item))
+            hit = self._maps[src.id()] = tuple(out)
+        return hit
+
+    def _product_entry(self, product):
+        hit = self._products.get(product.id())
+        self._stats["product_styles"][hit is None] += 1
+        if hit is None:
+            sis = []
+            rep = getattr(product, "Representation", None)
+            for shape in (rep.Representations or []) if rep else []:
+                for item in getattr(shape, "Items", []) or []:
+                    sis.extend(self.item_styled(item))
+                    if item and item.is_a("IfcMappedItem"):
+                        src = getattr(item, "MappingSource", None)
+                        if src:
+                            sis.extend(self.mapped_styled(src))
+            with self.profiler.phase("material_traversal"):
+                for mat in self.materials.materials_for_product(product, include_type=True):
+                    for it in self.materials.items_for_material(mat):
+                        sis.extend(self.item_styled(it))
+            styles = []
+            for si in sis:
+                styles.extend(self._rends[si.id()])
+            hit = self._products[product.id()] = (tuple(sis), tuple(styles))
+        return hit
+
+    def styled_items(self, product):
+        """IfcStyledItem entities behind styles(product), in the same order."""
+        return self._product_entry(product)[0]
+
+    def styles(self, product):
+        """Surface styles then material styles (instance + type) of a product, memoized."""
+        return self._product_entry(product)[1]
+
+    def surface_styles_of(self, si):
+        """IfcSurfaceStyle entities a styled item uses (as swept)."""
+        return self._surface.get(si.id(), ())
+
+    def users(self, style):
+        """Styled items that use an IfcSurfaceStyle (as swept)."""
+        return self._users.get(style.id(), ())
+
+    def container(self, si, style):
+        """The entry of si.Styles that holds `style` when the model was swept."""
+        return self._containers.get((si.id(), style.id()))
+
+    def renderings_of(self, style):
+        """Rendering/shading entities of an IfcSurfaceStyle."""
+        return tuple(_renderings_from_style_container(style))
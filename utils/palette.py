@@ -0,0 +1,71 @@
+# utils/palette.py
+import numpy as np
+
+METRICS = ("rgb", "delta_e")
+
+def rgb_to_lab(rgb):
+    """sRGB floats 0–1, shape (..., 3) -> CIE L*a*b* (D65), same shape."""
+    rgb = np.asarray(rgb, dtype=float)
+    lin = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    m = np.array([[0.4124564, 0.3575761, 0.1804375],
+                  [0.2126729, 0.7151522, 0.0721750],
+                  [0.0193339, 0.1191920, 0.9503041]])
+    xyz = lin @ m.T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16,
+                     500 * (f[..., 0] - f[..., 1]),
+                     200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+def to_space(rgb, metric="rgb"):
+    """Coordinates colours are compared in: raw RGB (Chebyshev) or Lab (ΔE76, Euclidean)."""
+    rgb = np.asarray(rgb, dtype=float)
+    return rgb_to_lab(rgb) if metric == "delta_e" else rgb
+
+def distances(a, b, metric="rgb"):
+    """Pairwise distances (len(a), len(b)) between coordinates from to_space()."""
+    d = np.abs(a[:, None, :] - b[None, :, :])
+    return np.sqrt((d ** 2).sum(axis=-1)) if metric == "delta_e" else d.max(axis=-1)
+
+class Palette:
+    """
+    The distinct colours of a rules list as one (N, 3) float array, parsed once.
+    `match()` maps them onto existing colours in one vectorized pass.
+    """
+    def __init__(self, rgbs):
+        rgbs = list(dict.fromkeys(tuple(float(x) for x in c) for c in rgbs))
+        self.colours = rgbs
+        self.rgb = np.array(rgbs, dtype=float).reshape(-1, 3)
+
+    @classmethod
+    def from_plan(cls, plan):
+        return cls(r.rgb for r in plan.rules)
+
+    def __len__(self):
+        return len(self.colours)
+
+    def match(self, existing, tol, metric="rgb", ids=None, nearest=True):
+        """
+        Existing colour per palette entry, in one vectorized pass.
+        `existing` is an (M, 3) RGB array and `ids` their entity ids. Among the
+        colours within `tol` the nearest wins (`nearest`) or the lowest id
+        (plain EPS dedup, like ColourRegistry.find). Returns an int array of
+        indices into `existing`, -1 where nothing lies within `tol`.
+        """
+        out = np.full(len(self), -1, dtype=int)
+        if not len(self) or not len(existing):
+            return out
+        ex = to_space(existing, metric)
+        pal = to_space(self.rgb, metric)
+        ids = np.arange(len(existing)) if ids is None else np.asarray(ids)
+        chunk = max(1, 4_000_000 // len(ex))  # keep the (chunk, M, 3) temporary ~100 MB
+        for start in range(0, len(pal), chunk):
+            d = distances(pal[start:start + chunk], ex, metric)
+            ok = d < tol
+            if nearest:
+                score = np.where(ok, d, np.inf)
+            else:
+                score = np.where(ok, ids[None, :], np.iinfo(np.int64).max)
+            best = score.argmin(axis=1)
+            hit = ok[np.arange(len(best)), best]
+            out[start:start + chunk] = np.where(hit, best, -1)
+        return out
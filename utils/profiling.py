@@ -0,0 +1,142 @@
+# utils/profiling.py
+"""
+Opt-in instrumentation for recolour runs. Code paths take a profiler
+object and call phase()/count(); NULL_PROFILER makes those no-ops so an
+uninstrumented run pays next to nothing.
+"""
+import cProfile
+import io
+import json
+import pstats
+import time
+from contextlib import contextmanager, nullcontext
+
+class _NullProfiler:
+    enabled = False
+
+    def phase(self, name):
+        return nullcontext()
+
+    def count(self, name, n=1):
+        pass
+
+NULL_PROFILER = _NullProfiler()
+
+class Profiler:
+    """
+    Wall time and call counts per phase, rule hit/evaluation costs and cache
+    hit rates for one run. Phases nest; each (nested) phase is also recorded
+    as open/close events (up to `max_events`) for a speedscope trace. With
+    `cprofile` the whole run is additionally profiled by cProfile.
+    """
+    enabled = True
+
+    def __init__(self, cprofile=False, max_events=200000):
+        self.phases = {}
+        self.counters = {}
+        self.rules = {}
+        self.caches = {}
+        self.max_events = max_events
+        self.events = []
+        self._t0 = time.perf_counter()
+        self._end = None
+        self._cprofile = cProfile.Profile() if cprofile else None
+
+    # ---------- recording ----------
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        recorded = len(self.events) < self.max_events
+        if recorded:
+            self.events.append(("O", name, start - self._t0))
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            acc = self.phases.setdefault(name, [0.0, 0])
+            acc[0] += end - start
+            acc[1] += 1
+            if recorded:
+                # always close what was opened so the trace stays balanced
+                self.events.append(("C", name, end - self._t0))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def rule_eval(self, index, seconds, hit):
+        acc = self.rules.setdefault(index, {"evaluations": 0, "matches": 0, "seconds": 0.0, "wins": 0})
+        acc["evaluations"] += 1
+        acc["matches"] += bool(hit)
+        acc["seconds"] += seconds
+
+    def rule_wins(self, index, n=1):
+        acc = self.rules.setdefault(index, {"evaluations": 0, "matches": 0, "seconds": 0.0, "wins": 0})
+        acc["wins"] += n
+
+    def cache(self, name, info):
+        """Record a cache's cache_info() ({"hits": .., "misses": ..}), summing repeated reports."""
+        acc = self.caches.setdefault(name, {"hits": 0, "misses": 0})
+        acc["hits"] += info.get("hits", 0)
+        acc["misses"] += info.get("misses", 0)
+
+    def start(self):
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._end = time.perf_counter() - self._t0
+
+    # ---------- export ----------
+    def as_dict(self, top=25):
+        caches = {}
+        for name, c in self.caches.items():
+            total = c["hits"] + c["misses"]
+            caches[name] = dict(c, hit_rate=round(c["hits"] / total, 4) if total else None)
+        out = {
+            "total_seconds": round(self._end if self._end is not None else time.perf_counter() - self._t0, 6),
+            "phases": {k: {"seconds": round(v[0], 6), "calls": v[1]} for k, v in self.phases.items()},
+            "counters": dict(self.counters),
+            "rules": {str(i): dict(v, seconds=round(v["seconds"], 6)) for i, v in sorted(self.rules.items())},
+            "caches": caches,
+        }
+        if self._cprofile is not None:
+            out["cprofile_top"] = self.cprofile_top(top)
+        return out
+
+    def to_json(self, **kw):
+        return json.dumps(self.as_dict(), indent=2, **kw)
+
+    def to_speedscope(self, name="recolor"):
+        """Phase timeline in speedscope's evented file format (https://www.speedscope.app)."""
+        frames, index, events = [], {}, []
+        for kind, phase, at in self.events:
+            if phase not in index:
+                index[phase] = len(frames)
+                frames.append({"name": phase})
+            events.append({"type": kind, "frame": index[phase], "at": at})
+        end = max([e["at"] for e in events] + [self._end or 0.0])
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{"type": "evented", "name": name, "unit": "seconds",
+                          "startValue": 0.0, "endValue": end, "events": events}],
+            "exporter": "ifcrecolour",
+        }
+
+    def cprofile_top(self, n=25):
+        if self._cprofile is None:
+            return []
+        st = pstats.Stats(self._cprofile, stream=io.StringIO())
+        rows = []
+        for (fname, line, func), (cc, nc, tt, ct, _) in st.stats.items():
+            rows.append({"function": f"{func} ({fname}:{line})", "calls": nc,
+                         "tottime": round(tt, 6), "cumtime": round(ct, 6)})
+        rows.sort(key=lambda r: r["cumtime"], reverse=True)
+        return rows[:n]
+
+    def dump_cprofile(self, path):
+        """Write the raw cProfile data (pstats format, e.g. for snakeviz)."""
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(path)